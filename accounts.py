@@ -0,0 +1,226 @@
+# Account deletion in two stages: deleting an account removes the User row
+# and queues its id straight away, and a background job purges the user's
+# carts afterwards in small chunks, so no transaction holds the write lock
+# for long however much history the user had
+import logging
+import threading
+import time
+
+import click
+from flask import current_app
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the app config doesn't set them
+DEFAULT_PURGE_CHUNK_SIZE = 500
+DEFAULT_PURGE_PAUSE = 0.05
+DEFAULT_VACUUM_PAGES = 1000
+
+# Each step deletes up to `chunk` rows for one user, and is repeated
+# until it deletes nothing. Items go before the carts that hold them.
+# Order snapshots are sales records and are kept
+PURGE_STEPS = [
+    ("CartItem", """DELETE FROM CartItem WHERE rowid IN (
+                        SELECT CartItem.rowid FROM Cart
+                        JOIN CartItem ON CartItem.cartid = Cart.cartid
+                        WHERE Cart.userid = ? LIMIT ?
+                    )"""),
+    ("Cart", """DELETE FROM Cart WHERE cartid IN (
+                    SELECT cartid FROM Cart WHERE userid = ? LIMIT ?
+                )"""),
+]
+
+
+def delete_account(userid):
+    """
+    Deletes the User row and queues the account for purging, in one
+    transaction. Returns False if there was no such user.
+    """
+    with db.write_transaction() as connection:
+        sql = "DELETE FROM User WHERE userid = ?"
+        if not connection.execute(sql, (userid,)).rowcount:
+            return False
+        sql = """INSERT OR IGNORE INTO DeletedUser (userid, deleted_at)
+                 VALUES (?, datetime('now'))"""
+        connection.execute(sql, (userid,))
+
+    if current_app.config["ACCOUNT_PURGE_IN_BACKGROUND"]:
+        current_app.extensions["soap_account_purger"].wake()
+    return True
+
+
+def purge_user(userid, chunk_size, pause):
+    """
+    Deletes a queued user's carts chunk by chunk, then takes the user
+    off the queue. Yields (table, rows deleted so far) after each chunk.
+    """
+    for table, sql in PURGE_STEPS:
+        deleted = 0
+        while True:
+            with db.write_transaction() as connection:
+                count = connection.execute(sql, (userid, chunk_size)).rowcount
+            if not count:
+                break
+            deleted += count
+            yield table, deleted
+            time.sleep(pause)
+
+    with db.write_transaction() as connection:
+        sql = "DELETE FROM DeletedUser WHERE userid = ?"
+        connection.execute(sql, (userid,))
+
+
+def incremental_vacuum(pages):
+    """
+    Returns up to `pages` free pages to the file system, if the database
+    uses incremental auto-vacuum (see `flask db enable-incremental-vacuum`).
+    """
+    if db.reader().execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return False
+    with db.write_transaction() as connection:
+        connection.execute(f"PRAGMA incremental_vacuum({int(pages)})") \
+            .fetchall()
+    return True
+
+
+def purge_pending(chunk_size, pause, vacuum_pages):
+    """
+    Purges every queued account, oldest first. Yields
+    (userid, table, rows deleted so far) as it goes.
+    """
+    sql = "SELECT userid FROM DeletedUser ORDER BY deleted_at, userid LIMIT 1"
+    while True:
+        row = db.reader().execute(sql).fetchone()
+        if row is None:
+            return
+        for table, deleted in purge_user(row[0], chunk_size, pause):
+            yield row[0], table, deleted
+        incremental_vacuum(vacuum_pages)
+
+
+def sweep_orphans(batch_size):
+    """
+    Queues every user that has carts but no User row, and deletes cart
+    items whose cart is gone, walking both tables in id ranges.
+    Yields (table, id reached, rows found so far).
+    """
+    found = 0
+    sql = "SELECT COALESCE(MAX(cartid), 0) FROM Cart"
+    last = db.reader().execute(sql).fetchone()[0]
+    sql = """INSERT OR IGNORE INTO DeletedUser (userid, deleted_at)
+             SELECT DISTINCT userid, datetime('now') FROM Cart
+             WHERE cartid > ? AND cartid <= ? AND userid IS NOT NULL
+             AND NOT EXISTS (
+                 SELECT 1 FROM User WHERE User.userid = Cart.userid
+             )"""
+    for start in range(0, last, batch_size):
+        with db.write_transaction() as connection:
+            found += connection.execute(
+                sql, (start, start + batch_size)).rowcount
+        yield "Cart", min(start + batch_size, last), found
+
+    found = 0
+    sql = "SELECT COALESCE(MAX(rowid), 0) FROM CartItem"
+    last = db.reader().execute(sql).fetchone()[0]
+    sql = """DELETE FROM CartItem
+             WHERE rowid > ? AND rowid <= ?
+             AND NOT EXISTS (
+                 SELECT 1 FROM Cart WHERE Cart.cartid = CartItem.cartid
+             )"""
+    for start in range(0, last, batch_size):
+        with db.write_transaction() as connection:
+            found += connection.execute(
+                sql, (start, start + batch_size)).rowcount
+        yield "CartItem", min(start + batch_size, last), found
+
+
+class AccountPurger:
+    """
+    Background thread that purges queued accounts.
+
+    Simplified explanation:
+    - delete_account() wakes it; it then works through the whole queue,
+      including accounts left over from before a restart.
+    - The queue lives in the database, so nothing is lost if the
+      process stops halfway; each chunk is its own transaction.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        # The thread starts on first use, so each worker process gets one
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="account-purger", daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        config = self.app.config
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    for userid, table, deleted in purge_pending(
+                            config["ACCOUNT_PURGE_CHUNK_SIZE"],
+                            config["ACCOUNT_PURGE_PAUSE"],
+                            config["ACCOUNT_VACUUM_PAGES"]):
+                        logger.info(f"Purged {deleted} {table} rows "
+                                    f"of deleted user {userid}")
+            except Exception as e:
+                logger.error(f"Account purge stopped: {e}")
+
+
+@click.group("accounts")
+def accounts_cli():
+    """Deleted-account maintenance."""
+
+
+@accounts_cli.command("purge")
+@click.option("--chunk-size", type=int,
+              help="Rows per transaction (default ACCOUNT_PURGE_CHUNK_SIZE).")
+@click.option("--pause", type=float,
+              help="Seconds between chunks (default ACCOUNT_PURGE_PAUSE).")
+@click.option("--orphans", is_flag=True,
+              help="First queue users whose carts outlived their account.")
+def purge_command(chunk_size, pause, orphans):
+    """Purge the carts of deleted accounts."""
+    config = current_app.config
+    chunk_size = chunk_size or config["ACCOUNT_PURGE_CHUNK_SIZE"]
+    if pause is None:
+        pause = config["ACCOUNT_PURGE_PAUSE"]
+
+    if orphans:
+        for table, reached, found in sweep_orphans(chunk_size):
+            click.echo(f"Swept {table} up to id {reached}, "
+                       f"{found} orphaned", err=True)
+
+    sql = "SELECT COUNT(*) FROM DeletedUser"
+    queued = db.reader().execute(sql).fetchone()[0]
+    for userid, table, deleted in purge_pending(
+            chunk_size, pause, config["ACCOUNT_VACUUM_PAGES"]):
+        click.echo(f"User {userid}: {deleted} {table} rows", err=True)
+    click.echo(f"Purged {queued} deleted accounts")
+
+
+def init_app(app):
+    """
+    Registers the purge defaults and commands, and creates the
+    background purger.
+    """
+    app.config.setdefault("ACCOUNT_PURGE_CHUNK_SIZE",
+                          DEFAULT_PURGE_CHUNK_SIZE)
+    app.config.setdefault("ACCOUNT_PURGE_PAUSE", DEFAULT_PURGE_PAUSE)
+    app.config.setdefault("ACCOUNT_VACUUM_PAGES", DEFAULT_VACUUM_PAGES)
+    app.config.setdefault("ACCOUNT_PURGE_IN_BACKGROUND", True)
+    app.extensions["soap_account_purger"] = AccountPurger(app)
+    app.cli.add_command(accounts_cli)
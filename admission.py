@@ -0,0 +1,207 @@
+# Admission control for routes that write: per-client and per-route-class
+# token buckets, and a cap on write requests in flight. SQLite has one
+# writer, so excess requests are turned away at once with 429 or 503
+# rather than piling up on the database lock
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request, session
+
+# Routes that write, by endpoint, and the class their limits come from.
+# Only unsafe methods count, except for the endpoints in WRITES_ON_GET
+ROUTE_CLASSES = {
+    "login": "login",
+    "signup": "signup",
+    "customer_service": "contact",
+    "add_to_cart": "cart",
+    "decrease_quantity": "cart",
+    "complete_order": "cart",
+    "api.update_cart": "cart",
+    "update_info": "account",
+    "delete_account": "account",
+}
+WRITES_ON_GET = {"complete_order"}
+
+# Default limits per route class: requests per second and burst for each
+# client, then requests per second and burst for all clients together
+DEFAULT_LIMITS = {
+    "login": (0.5, 5, 50, 100),
+    "signup": (0.1, 3, 10, 20),
+    "contact": (0.05, 3, 5, 10),
+    "cart": (5, 20, 500, 1000),
+    "account": (0.5, 5, 20, 50),
+}
+
+# Default write requests in flight, and how many more may wait briefly
+# for one to finish before being turned away
+DEFAULT_MAX_WRITES = 8
+DEFAULT_MAX_QUEUED = 16
+DEFAULT_QUEUE_TIMEOUT = 0.1
+
+# Most clients whose buckets are remembered; the least recently seen
+# are forgotten first, which only ever gives them a full bucket again
+DEFAULT_MAX_CLIENTS = 100000
+
+
+class RateLimited(Exception):
+    """
+    Raised when a client, or everyone together, is sending one class of
+    request faster than its limit; answered with a 429.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """
+    Raised when too many write requests are already in flight; answered
+    with a 503.
+    """
+
+
+class AdmissionControl:
+    """
+    Decides whether a write request may run.
+
+    Simplified explanation:
+    - Each client has a token bucket per route class, and each class has
+      one shared by all clients. A request takes a token from both;
+      buckets refill at the class's rate up to its burst size.
+    - At most `max_writes` admitted requests run at once. Up to
+      `max_queued` more wait `queue_timeout` seconds for a slot; the
+      rest are shed straight away.
+    """
+
+    def __init__(self, limits, max_writes, max_queued, queue_timeout,
+                 max_clients):
+        self.limits = limits
+        self.max_writes = max_writes
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._slots = threading.BoundedSemaphore(max_writes)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.counts = {"admitted": 0, "queued": 0, "rate_limited": 0,
+                       "overloaded": 0}
+
+    def _refill(self, key, rate, burst, now):
+        # Tops one bucket up for the time since it was last used (under
+        # the lock) and returns its tokens
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return tokens
+
+    def admit(self, client, route_class):
+        """
+        Admits one request or raises RateLimited or Overloaded. An
+        admitted request must be followed by release().
+        """
+        rate, burst, class_rate, class_burst = self.limits[route_class]
+        buckets = [((route_class, client), rate, burst),
+                   ((route_class, None), class_rate, class_burst)]
+        now = time.monotonic()
+        with self._lock:
+            refilled = [(key, self._refill(key, *limit, now), limit[0])
+                        for key, *limit in buckets]
+            # Tokens are only taken once both buckets have one, so a
+            # request turned away doesn't use up the client's allowance
+            waits = [(1 - tokens) / bucket_rate
+                     for _, tokens, bucket_rate in refilled if tokens < 1]
+            if waits:
+                self.counts["rate_limited"] += 1
+                raise RateLimited(max(waits))
+            for key, tokens, _ in refilled:
+                self._buckets[key] = (tokens - 1, now)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queued:
+                    self.counts["overloaded"] += 1
+                    raise Overloaded()
+                self.waiting += 1
+                self.counts["queued"] += 1
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+            with self._lock:
+                self.waiting -= 1
+                if not acquired:
+                    self.counts["overloaded"] += 1
+                    raise Overloaded()
+
+        with self._lock:
+            self.in_flight += 1
+            self.counts["admitted"] += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, in_flight=self.in_flight,
+                        waiting=self.waiting, clients=len(self._buckets))
+
+
+def route_class():
+    """
+    Returns the route class of the current request, or None if it
+    doesn't write.
+    """
+    endpoint = request.endpoint
+    if request.method in ("GET", "HEAD", "OPTIONS") \
+            and endpoint not in WRITES_ON_GET:
+        return None
+    return ROUTE_CLASSES.get(endpoint)
+
+
+def admit_request():
+    # Logged-in users are limited per account, everyone else per address
+    name = route_class()
+    if name is None or not current_app.config["ADMISSION_ENABLED"]:
+        return
+    userid = session.get("userid")
+    client = f"user:{userid}" if userid else f"ip:{request.remote_addr}"
+    current_app.extensions["soap_admission"].admit(client, name)
+    g.admitted_write = True
+
+
+def release_request(error=None):
+    if g.pop("admitted_write", False):
+        current_app.extensions["soap_admission"].release()
+
+
+def retry_after(error):
+    # Whole seconds, as the Retry-After header needs
+    return str(max(1, math.ceil(error.retry_after)))
+
+
+def init_app(app):
+    """
+    Registers the admission defaults and the hooks that admit write
+    requests and release their slots.
+    """
+    app.config.setdefault("ADMISSION_ENABLED", True)
+    app.config.setdefault("ADMISSION_LIMITS", DEFAULT_LIMITS)
+    app.config.setdefault("ADMISSION_MAX_WRITES", DEFAULT_MAX_WRITES)
+    app.config.setdefault("ADMISSION_MAX_QUEUED", DEFAULT_MAX_QUEUED)
+    app.config.setdefault("ADMISSION_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+    app.config.setdefault("ADMISSION_MAX_CLIENTS", DEFAULT_MAX_CLIENTS)
+
+    limits = dict(DEFAULT_LIMITS, **app.config["ADMISSION_LIMITS"])
+    app.extensions["soap_admission"] = AdmissionControl(
+        limits, app.config["ADMISSION_MAX_WRITES"],
+        app.config["ADMISSION_MAX_QUEUED"],
+        app.config["ADMISSION_QUEUE_TIMEOUT"],
+        app.config["ADMISSION_MAX_CLIENTS"])
+    app.before_request(admit_request)
+    app.teardown_request(release_request)
@@ -0,0 +1,153 @@
+# Versioned JSON API for the catalog, search and the cart, so pages can
+# update in place instead of posting a form and reloading after a
+# redirect. Responses are compact: soaps are arrays in the order given
+# by "fields", not one object per soap
+from flask import Blueprint, current_app, request, session
+
+import cart
+import catalog
+import fulltext
+import pagecache
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# Largest batch and largest quantity a single cart request may set
+DEFAULT_API_MAX_BATCH = 100
+DEFAULT_API_MAX_QUANTITY = 99
+
+# Field order of the soap arrays in catalog and search responses
+CATALOG_FIELDS = ["soapid", "name", "description", "price", "picture",
+                  "is_featured"]
+SEARCH_FIELDS = ["soapid", "name", "price", "picture"]
+
+
+class InvalidCartChange(Exception):
+    """Raised when a request body can't be used; answered with a 400."""
+
+
+def error(message, status):
+    return {"error": message}, status
+
+
+@bp.errorhandler(InvalidCartChange)
+def invalid_cart_change(e):
+    return error(str(e), 400)
+
+
+def cart_summary(userid):
+    """
+    Returns the user's cart as sent to clients: the open cart's id (or
+    None), its lines as [soapid, quantity, unit price], and the total.
+    """
+    cartid, rows = cart.contents(userid)
+    items = [[soapid, quantity, price]
+             for soapid, _, price, quantity in rows]
+    total = round(sum(price * quantity for _, _, price, quantity in rows), 2)
+    return {"cartid": cartid, "items": items, "total": total}
+
+
+def read_quantities(body, name, minimum):
+    """
+    Reads one {soapid: number} object from a cart request body, checking
+    every soap exists and every number is in range.
+    """
+    values = body.get(name) or {}
+    if not isinstance(values, dict):
+        raise InvalidCartChange(f"{name} must map soapids to numbers")
+
+    maximum = current_app.config["API_MAX_QUANTITY"]
+    soaps = catalog.get_catalog().by_id
+    result = {}
+    for key, value in values.items():
+        try:
+            soapid = int(key)
+        except ValueError:
+            raise InvalidCartChange(f"Unknown soap {key}")
+        if soapid not in soaps:
+            raise InvalidCartChange(f"Unknown soap {key}")
+        if type(value) is not int or not minimum <= value <= maximum:
+            raise InvalidCartChange(f"{name}[{key}] must be a whole "
+                                    f"number from {minimum} to {maximum}")
+        result[soapid] = value
+    return result
+
+
+# Every soap, for clients that render the catalog themselves. Anonymous
+# requests share one cached response per catalog version
+@bp.route("/catalog")
+@pagecache.cached_page(uses_catalog=True)
+def get_catalog():
+    snapshot = catalog.get_catalog()
+    return {"version": snapshot.version, "fields": CATALOG_FIELDS,
+            "soaps": [list(soap) for soap in snapshot.gallery]}
+
+
+# One page of search results, taking the same arguments as /search
+@bp.route("/search")
+@pagecache.cached_page(uses_catalog=True)
+def search():
+    page = fulltext.search_soaps(
+        request.args.get("search_term", "").strip(),
+        request.args.get("sort", "").strip(),
+        fulltext.decode_cursor(request.args.get("after")),
+        fulltext.decode_cursor(request.args.get("before")),
+        current_app.config["SEARCH_PAGE_SIZE"])
+    soaps = catalog.get_catalog().by_id
+    results = [soaps[soapid] for soapid in page.soapids if soapid in soaps]
+
+    response = {
+        "fields": SEARCH_FIELDS,
+        "soaps": [[soap.soapid, soap.name, soap.price, soap.picture]
+                  for soap in results],
+        "previous": page.previous_cursor,
+        "next": page.next_cursor,
+    }
+    # Logged-in users also get how many of each soap are in their cart
+    userid = session.get("userid")
+    if userid:
+        response["in_cart"] = cart.quantities(userid, page.soapids)
+    return response
+
+
+# The logged-in user's open cart
+@bp.route("/cart")
+def get_cart():
+    userid = session.get("userid")
+    if not userid:
+        return error("Please log in to view your cart", 401)
+    return cart_summary(userid)
+
+
+# Changes many cart lines in one transaction. The body sets quantities,
+# adds to them, or both:
+#   {"set": {"12": 3, "40": 0}, "add": {"7": 1, "9": -1}}
+@bp.route("/cart", methods=["PATCH", "POST"])
+def update_cart():
+    userid = session.get("userid")
+    if not userid:
+        return error("Please log in to update your cart", 401)
+
+    # Only JSON bodies are read, which a cross-site form can't send
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return error("Expected a JSON object", 415)
+
+    quantities = read_quantities(body, "set", 0)
+    changes = read_quantities(body, "add",
+                              -current_app.config["API_MAX_QUANTITY"])
+    if len(quantities) + len(changes) > current_app.config["API_MAX_BATCH"]:
+        return error("Too many soaps in one request", 413)
+
+    # Additions stop at the largest quantity a request may set
+    cart.update_items(userid, quantities, changes,
+                      current_app.config["API_MAX_QUANTITY"])
+    return cart_summary(userid)
+
+
+def init_app(app):
+    """
+    Registers the API limits and the /api/v1 blueprint.
+    """
+    app.config.setdefault("API_MAX_BATCH", DEFAULT_API_MAX_BATCH)
+    app.config.setdefault("API_MAX_QUANTITY", DEFAULT_API_MAX_QUANTITY)
+    app.register_blueprint(bp)
@@ -0,0 +1,173 @@
+# Static asset build: minifies and content-hashes the stylesheet and
+# scripts, precompresses them with gzip and (if installed) brotli, and
+# serves each request the smallest variant its Accept-Encoding allows
+import gzip
+import hashlib
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+
+import manifests
+
+# Files under static/ that the build fingerprints
+ASSETS = ["styles.css", "cart.js", "suggest.js"]
+
+# Where built files and their manifest live, relative to the static folder
+BUILD_DIR = "build"
+manifest = manifests.Manifest(BUILD_DIR)
+
+# Precompressed variants in order of preference, with their extensions
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def minify_css(css):
+    """
+    Removes comments and the whitespace CSS doesn't need. The strings
+    and url() values in styles.css have no spaces beside punctuation,
+    so this simple approach leaves them intact.
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+# Minifiers by file extension; other files are only fingerprinted
+MINIFIERS = {".css": minify_css}
+
+
+def compress(data, encoding):
+    """
+    Returns `data` compressed at the highest level, or None if that
+    encoding isn't available here.
+    """
+    if encoding == "gzip":
+        # A fixed mtime keeps the output the same for the same input
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def build_asset(source_path, build_path, name):
+    """
+    Writes the minified, fingerprinted file and its compressed variants.
+    Returns its manifest entry.
+    """
+    stem, extension = os.path.splitext(name)
+    with open(source_path, "rb") as file:
+        data = file.read()
+    minify = MINIFIERS.get(extension)
+    if minify:
+        data = minify(data.decode()).encode()
+
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    built_name = f"{stem}.{digest}{extension}"
+    outputs = {built_name: data}
+    encodings = []
+    for encoding, suffix in ENCODINGS:
+        compressed = compress(data, encoding)
+        # Variants that don't save anything aren't worth serving
+        if compressed is not None and len(compressed) < len(data):
+            outputs[built_name + suffix] = compressed
+            encodings.append(encoding)
+
+    for output_name, output in outputs.items():
+        target = os.path.join(build_path, output_name)
+        if not os.path.exists(target):
+            with open(target, "wb") as file:
+                file.write(output)
+    return {"path": f"{BUILD_DIR}/{built_name}", "encodings": encodings,
+            "bytes": {output_name: len(output)
+                      for output_name, output in outputs.items()}}
+
+
+def asset_url(name):
+    """
+    Template helper: the fingerprinted URL of a static asset, or its
+    plain URL if it hasn't been built.
+    """
+    entry = manifest.load(current_app).get(name)
+    return url_for("static", filename=entry["path"] if entry else name)
+
+
+def _built_entry(filename):
+    # The manifest entry a built file's path belongs to
+    for entry in manifest.load(current_app).values():
+        if entry["path"] == filename:
+            return entry
+    return None
+
+
+def serve_precompressed(response):
+    """
+    Swaps a built asset for its best precompressed variant.
+    """
+    if not manifests.is_built_file(manifest):
+        return response
+    filename = request.view_args["filename"]
+    entry = _built_entry(filename)
+    if entry is None or not entry["encodings"]:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200:
+        return response
+
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        if encoding in entry["encodings"] and accepted[encoding]:
+            variant = send_from_directory(
+                current_app.static_folder, filename + suffix,
+                mimetype=response.mimetype)
+            variant.headers["Content-Encoding"] = encoding
+            variant.vary.add("Accept-Encoding")
+            response.close()
+            # The cache-header hook may already have run on `response`
+            return manifests.add_cache_headers(variant)
+    return response
+
+
+@click.group("assets")
+def assets_cli():
+    """Static asset commands."""
+
+
+@assets_cli.command("build")
+def build_command():
+    """Minify, fingerprint and precompress the static assets."""
+    static = current_app.static_folder
+    build_path = os.path.join(static, BUILD_DIR)
+    os.makedirs(build_path, exist_ok=True)
+
+    # Files from earlier builds are kept, so pages that still link to
+    # them keep working until they are re-rendered
+    entries = {}
+    for name in ASSETS:
+        entries[name] = build_asset(os.path.join(static, name),
+                                    build_path, name)
+        sizes = ", ".join(f"{output} {size} bytes" for output, size
+                          in entries[name]["bytes"].items())
+        click.echo(f"{name}: {sizes}", err=True)
+
+    if not any("br" in entry["encodings"] for entry in entries.values()):
+        click.echo("brotli isn't installed, so only gzip variants were "
+                   "built: pip install brotli", err=True)
+
+    manifest.write(current_app, entries)
+    click.echo(f"Built {len(entries)} assets")
+
+
+def init_app(app):
+    """
+    Registers the template helper, the precompressed-variant hook and
+    the `flask assets` commands.
+    """
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.after_request(serve_precompressed)
+    manifests.register(app, manifest)
+    app.cli.add_command(assets_cli)
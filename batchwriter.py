@@ -0,0 +1,179 @@
+# Group-commit writer: buffers single-row inserts from many requests and
+# writes them with executemany, one transaction (and one fsync) per batch
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from flask import current_app
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue by close() so the writer drains everything before it
+_STOP = object()
+
+# Attempts at writing one batch before its rows are given up on
+FLUSH_ATTEMPTS = 3
+
+# Contact form submissions are buffered and written in batches, so a
+# burst of them costs one commit per batch instead of one per request
+CUSTOMER_SERVICE_SQL = """INSERT INTO CustomerServiceRequest
+    (name, email, subject, message, created_at)
+    VALUES (?, ?, ?, ?, ?)"""
+
+
+class WriterBusy(Exception):
+    """
+    Raised when the writer's buffer is full, so the request can be
+    turned away instead of piling up more memory.
+    """
+
+
+class PendingWrite:
+    """
+    One buffered row. wait() blocks until its batch has been committed.
+    """
+
+    __slots__ = ("params", "done", "error")
+
+    def __init__(self, params):
+        self.params = params
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        """
+        Returns True once the row is committed, False on timeout, and
+        re-raises the error if its batch could not be written.
+        """
+        if not self.done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+class BatchWriter:
+    """
+    Writes rows for one INSERT statement from a background thread.
+
+    Simplified explanation:
+    - submit() puts a row on a bounded queue and returns straight away.
+    - The thread takes up to `batch_size` rows, waiting at most
+      `flush_interval` seconds for a batch to fill, then commits them
+      all with a single executemany.
+    - close() flushes whatever is left; it also runs at interpreter exit.
+    - `transaction` is called once per batch and returns a context
+      manager giving a connection in a write transaction.
+    """
+
+    def __init__(self, sql, transaction, batch_size=100, flush_interval=0.05,
+                 max_pending=10000):
+        self.sql = sql
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._transaction = transaction
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_started(self):
+        # The thread starts on first use, so each worker process gets one
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="batch-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def submit(self, params, timeout=0.5):
+        """
+        Buffers one row, waiting up to `timeout` seconds for room.
+        Raises WriterBusy if the buffer stays full.
+        """
+        self._ensure_started()
+        write = PendingWrite(params)
+        try:
+            self._queue.put(write, timeout=timeout)
+        except queue.Full:
+            raise WriterBusy() from None
+        return write
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        error = None
+        for attempt in range(FLUSH_ATTEMPTS):
+            try:
+                with self._transaction() as connection:
+                    connection.executemany(
+                        self.sql, [write.params for write in batch])
+                error = None
+                break
+            except Exception as e:
+                error = e
+                time.sleep(0.05 * 2 ** attempt)
+        if error is not None:
+            logger.error(f"Dropped batch of {len(batch)} rows: {error}")
+        else:
+            self.batches += 1
+            self.rows += len(batch)
+        for write in batch:
+            write.error = error
+            write.done.set()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                self._flush(batch)
+            if stopping:
+                break
+
+    def close(self, timeout=10):
+        # Flushes everything buffered so far and stops the thread
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+def customer_service_writer():
+    return current_app.extensions["soap_customer_service_writer"]
+
+
+def init_app(app):
+    """
+    Registers the customer service writer's config defaults and creates
+    the writer; its thread starts with the first submission.
+    """
+    app.config.setdefault("CUSTOMER_SERVICE_BATCH_SIZE", 100)
+    app.config.setdefault("CUSTOMER_SERVICE_FLUSH_INTERVAL", 0.05)
+    app.config.setdefault("CUSTOMER_SERVICE_QUEUE_SIZE", 10000)
+    app.config.setdefault("CUSTOMER_SERVICE_ENQUEUE_TIMEOUT", 0.5)
+    app.config.setdefault("CUSTOMER_SERVICE_WAIT_FOR_COMMIT", True)
+    app.config.setdefault("CUSTOMER_SERVICE_COMMIT_TIMEOUT", 5)
+    app.extensions["soap_customer_service_writer"] = BatchWriter(
+        CUSTOMER_SERVICE_SQL, lambda: db.write_transaction(app),
+        app.config["CUSTOMER_SERVICE_BATCH_SIZE"],
+        app.config["CUSTOMER_SERVICE_FLUSH_INTERVAL"],
+        app.config["CUSTOMER_SERVICE_QUEUE_SIZE"])
@@ -0,0 +1,83 @@
+# Compares requests per second for connect-per-call queries against the
+# pooled connections in db.py, using Flask's test client on a copy of Soap.db
+#
+# Run from the repository root:  python -m benchmarks.connection_pool
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from flask import g
+
+# Point the app at a scratch copy before it is imported and opens the database
+WORKDIR = tempfile.mkdtemp()
+DATABASE = os.path.join(WORKDIR, "Soap.db")
+shutil.copy("Soap.db", DATABASE)
+os.environ["SOAP_DATABASE"] = DATABASE
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import routes  # noqa: E402
+
+ROUTES = ["/", "/search?search_term=soap", "/search?sort=alpha"]
+
+pooled_reader = db.reader
+
+
+def connect_per_call():
+    # The old behaviour: a fresh connection, without pragmas, for every
+    # statement. Every module reads through db.reader(), so replacing it
+    # reaches the catalog and search queries too
+    connection = db.connect(routes.app.config["DATABASE"])
+    g.setdefault("per_call_connections", []).append(connection)
+    return connection
+
+
+def close_per_call(exception=None):
+    for connection in g.pop("per_call_connections", []):
+        connection.close()
+
+
+def run(client, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        client.get(ROUTES[i % len(ROUTES)]).close()
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Connect-per-call vs pooled connections")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    migrations.upgrade(routes.app)
+    routes.app.teardown_appcontext(close_per_call)
+    # Cached pages and fragments would skip most of the queries
+    routes.app.extensions["soap_page_cache"].size = 0
+    routes.app.extensions["soap_fragment_cache"].max_bytes = 0
+    client = routes.app.test_client()
+
+    try:
+        db.reader = connect_per_call
+        run(client, 50)  # compile templates and load the catalog
+        before = run(client, args.requests)
+        pool = routes.app.extensions.get("soap_db_pool")
+        assert pool is None or pool.opened == 0, "reads went to the pool"
+
+        db.reader = pooled_reader
+        run(client, 50)  # warm the pool
+        after = run(client, args.requests)
+    finally:
+        db.reader = pooled_reader
+        db.close_connections(routes.app)
+        shutil.rmtree(WORKDIR)
+
+    print(f"connect per call: {before:8.1f} req/s")
+    print(f"pooled:           {after:8.1f} req/s")
+    print(f"speedup:          {after / before:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Deterministic synthetic data generator: builds a copy of the Soap.db
+# schema and fills it with configurable volumes of users, carts and soaps
+#
+# Run from the repository root, for example:
+#   python -m benchmarks.generate bench.db --users 1000000 --carts 5000000 \
+#       --cart-items 20000000 --soaps 100000
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+from werkzeug.security import generate_password_hash
+
+import migrations
+
+# Tables copied from Soap.db; indexes, search and the rest come from the
+# migrations, which run after the bulk load so indexes are built once
+BASE_TABLES = ["User", "Soap", "Cart", "CartItem", "CustomerServiceRequest"]
+
+# Every generated user can log in with this password
+PASSWORD = "password"
+
+CHUNK_SIZE = 50000
+
+# Orders are spread over the two years from this date
+START_DATE = datetime.datetime(2023, 1, 1)
+
+WORDS = ["lavender", "citrus", "oatmeal", "honey", "charcoal", "mint",
+         "rose", "shea", "coconut", "lime", "almond", "tea", "cedar",
+         "berry", "mango", "jasmine", "sea", "salt", "vanilla", "ginger"]
+
+
+def copy_schema(source, connection):
+    for name in BASE_TABLES:
+        sql = source.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (name,)).fetchone()[0]
+        connection.execute(sql)
+
+
+def insert_chunks(connection, sql, rows):
+    """
+    Inserts rows from a generator in chunked executemany transactions,
+    so memory stays flat however many rows are generated.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            connection.executemany(sql, chunk)
+            connection.commit()
+            chunk = []
+    if chunk:
+        connection.executemany(sql, chunk)
+        connection.commit()
+
+
+def soaps(rng, count, pictures):
+    for soapid in range(1, count + 1):
+        words = rng.sample(WORDS, 3)
+        yield (soapid, f"{words[0].title()} {words[1].title()} {soapid}",
+               f"A {words[0]} soap with notes of {words[1]} and {words[2]}.",
+               round(rng.uniform(2, 15), 2), rng.choice(pictures),
+               1 if rng.random() < 0.01 else 0)
+
+
+def users(count, password_hash):
+    for userid in range(1, count + 1):
+        yield (userid, f"First{userid}", f"Last{userid}",
+               f"user{userid}@example.com", password_hash)
+
+
+def carts(rng, count, user_count):
+    # Spread carts over users; each user's last cart is their open one
+    for cartid in range(1, count + 1):
+        userid = (cartid - 1) % user_count + 1
+        status = "open" if cartid + user_count > count else "completed"
+        order_date = START_DATE + datetime.timedelta(
+            seconds=rng.randrange(730 * 24 * 3600))
+        yield (cartid, userid, order_date.isoformat(" "), status)
+
+
+def cart_items(rng, count, cart_count, soap_count):
+    per_cart, extra = divmod(count, cart_count)
+    for cartid in range(1, cart_count + 1):
+        size = min(per_cart + (1 if cartid <= extra else 0), soap_count)
+        for soapid in rng.sample(range(1, soap_count + 1), size):
+            yield (soapid, cartid, rng.randint(1, 5))
+
+
+def generate(path, users_count, carts_count, items_count, soaps_count,
+             seed=0, source="Soap.db"):
+    """
+    Writes a fresh database at `path` and returns the seconds taken.
+    The same arguments and seed always produce the same data.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = OFF")
+    original = sqlite3.connect(source)
+    copy_schema(original, connection)
+    pictures = [row[0] for row in original.execute(
+        "SELECT DISTINCT picture FROM Soap WHERE picture IS NOT NULL")]
+    original.close()
+
+    insert_chunks(connection, "INSERT INTO Soap (soapid, name, description, \
+        price, picture, is_featured) VALUES (?, ?, ?, ?, ?, ?)",
+                  soaps(rng, soaps_count, pictures))
+    insert_chunks(connection, "INSERT INTO User (userid, fname, lname, \
+        email, password) VALUES (?, ?, ?, ?, ?)",
+                  users(users_count, generate_password_hash(PASSWORD)))
+    insert_chunks(connection, "INSERT INTO Cart (cartid, userid, \
+        order_date, status) VALUES (?, ?, ?, ?)",
+                  carts(rng, carts_count, users_count))
+    insert_chunks(connection, "INSERT INTO CartItem (soapid, cartid, \
+        quantity) VALUES (?, ?, ?)",
+                  cart_items(rng, items_count, carts_count, soaps_count))
+
+    migrations.migrate(connection)
+    connection.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic copy of the Soap.db schema")
+    parser.add_argument("path", help="database file to create")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--carts", type=int, default=50000)
+    parser.add_argument("--cart-items", type=int, default=200000)
+    parser.add_argument("--soaps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    seconds = generate(args.path, args.users, args.carts, args.cart_items,
+                       args.soaps, args.seed)
+    print(f"Wrote {args.path} in {seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# Per-route load harness: drives the app through Flask's test client and
+# reports throughput and p50/p95/p99 latency per route as JSON
+#
+# Run from the repository root against a generated database, for example:
+#   python -m benchmarks.generate bench.db
+#   python -m benchmarks.load bench.db --requests 2000 --threads 4 \
+#       --output results.json
+# The database is written to (carts, logins), so use a scratch copy.
+import argparse
+import importlib
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import threading
+import time
+
+from benchmarks.generate import PASSWORD, WORDS
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def search(client, rng, sizes):
+    return client.get("/search", query_string={
+        "search_term": rng.choice(WORDS)})
+
+
+def add_to_cart(client, rng, sizes):
+    return client.post("/add_to_cart", data={
+        "soapid": rng.randint(1, sizes["soaps"]),
+        "redirect_url": "/search"})
+
+
+def login(client, rng, sizes):
+    return client.post("/login", data={
+        "email": f"user{rng.randint(1, sizes['users'])}@example.com",
+        "password": PASSWORD})
+
+
+# Each route, the request that exercises it, and whether it needs a
+# logged-in session
+ROUTES = {
+    "/": (lambda client, rng, sizes: client.get("/"), False),
+    "/search": (search, False),
+    "/add_to_cart": (add_to_cart, True),
+    "/view_current_cart": (
+        lambda client, rng, sizes: client.get("/view_current_cart"), True),
+    "/previous_carts": (
+        lambda client, rng, sizes: client.get("/previous_carts"), True),
+    "/login": (login, False),
+}
+
+
+def table_sizes(database):
+    connection = sqlite3.connect(database)
+    sizes = {
+        "users": connection.execute("SELECT MAX(userid) FROM User")
+        .fetchone()[0] or 1,
+        "soaps": connection.execute("SELECT MAX(soapid) FROM Soap")
+        .fetchone()[0] or 1,
+    }
+    connection.close()
+    return sizes
+
+
+def run_route(app, name, requests, threads, sizes, seed):
+    """
+    Sends `requests` requests to one route from `threads` threads and
+    returns its throughput, error count and latency percentiles.
+    """
+    send, needs_login = ROUTES[name]
+    latencies = []
+    errors = []
+    shed = []
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(seed + index)
+        client = app.test_client()
+        # Each thread is its own client to the per-client rate limits
+        client.environ_base["REMOTE_ADDR"] = \
+            f"10.0.{index // 256}.{index % 256}"
+        if needs_login:
+            with client.session_transaction() as session:
+                session["userid"] = rng.randint(1, sizes["users"])
+        timings = []
+        failed = 0
+        turned_away = 0
+        for _ in range(count):
+            # Streamed pages render as the body is read, and closing the
+            # response pops its request context
+            start = time.perf_counter()
+            response = send(client, rng, sizes)
+            response.get_data()
+            response.close()
+            timings.append(time.perf_counter() - start)
+            if response.status_code in (429, 503):
+                turned_away += 1
+            elif response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(timings)
+            errors.append(failed)
+            shed.append(turned_away)
+
+    counts = [requests // threads + (1 if i < requests % threads else 0)
+              for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(i, count))
+               for i, count in enumerate(counts)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "shed": sum(shed),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-route throughput and latency benchmark")
+    parser.add_argument("database", help="database to run against")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per route")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES),
+                        choices=list(ROUTES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-admission", action="store_true",
+                        help="turn off rate limits and the write cap")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # The app reads its database path when it is first imported
+    os.environ["SOAP_DATABASE"] = args.database
+    app = importlib.import_module("routes").app
+    app.config["ADMISSION_ENABLED"] = not args.no_admission
+    sizes = table_sizes(args.database)
+
+    report = {
+        "commit": current_commit(),
+        "database": args.database,
+        "threads": args.threads,
+        "routes": {name: run_route(app, name, args.requests, args.threads,
+                                   sizes, args.seed)
+                   for name in args.routes},
+        "admission": app.extensions["soap_admission"].stats(),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
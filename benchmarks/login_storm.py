@@ -0,0 +1,93 @@
+# Measures catalog-page latency while a storm of logins is running, with
+# password hashing inline on the request thread and in the process pool
+#
+# Run from the repository root against a generated database, for example:
+#   python -m benchmarks.generate bench.db
+#   python -m benchmarks.login_storm bench.db --storm-threads 8
+import argparse
+import importlib
+import json
+import os
+import random
+import threading
+import time
+
+from benchmarks.generate import PASSWORD
+from benchmarks.load import percentile, table_sizes
+
+
+def storm(app, sizes, stop, seed):
+    # Keeps logging in random users until told to stop
+    rng = random.Random(seed)
+    client = app.test_client()
+    while not stop.is_set():
+        client.post("/login", data={
+            "email": f"user{rng.randint(1, sizes['users'])}@example.com",
+            "password": PASSWORD})
+
+
+def measure(app, service, sizes, storm_threads, probes):
+    """
+    Swaps in the given hashing service, starts the login storm and
+    returns latency percentiles for a logged-in view of the home page.
+    """
+    app.extensions["soap_hashing"] = service
+    stop = threading.Event()
+    stormers = [threading.Thread(target=storm, args=(app, sizes, stop, i))
+                for i in range(storm_threads)]
+    for thread in stormers:
+        thread.start()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["userid"] = 1
+    latencies = []
+    try:
+        for _ in range(probes):
+            start = time.perf_counter()
+            client.get("/")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        for thread in stormers:
+            thread.join()
+        service.shutdown()
+
+    latencies.sort()
+    return {name: round(percentile(latencies, fraction) * 1000, 3)
+            for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95),
+                                   ("p99_ms", 0.99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Catalog-page latency during a login storm")
+    parser.add_argument("database", help="database to run against")
+    parser.add_argument("--storm-threads", type=int, default=8)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["SOAP_DATABASE"] = args.database
+    app = importlib.import_module("routes").app
+    passwords = importlib.import_module("passwords")
+    sizes = table_sizes(args.database)
+    config = app.config
+
+    def service(workers):
+        # A generous queue limit so the storm is never turned away
+        return passwords.HashingService(
+            workers, args.storm_threads + 1,
+            config["PASSWORD_HASH_METHOD"], config["HASH_TIMEOUT"])
+
+    report = {
+        "storm_threads": args.storm_threads,
+        "inline": measure(app, service(0), sizes, args.storm_threads,
+                          args.probes),
+        "pool": measure(app, service(config["HASH_WORKERS"]), sizes,
+                        args.storm_threads, args.probes),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
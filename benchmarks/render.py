@@ -0,0 +1,91 @@
+# Measures template render time per route with the fragment cache on and
+# off, and how long a cold worker takes to load every template with and
+# without the bytecode cache
+#
+# Run from the repository root against a generated database, for example:
+#   python -m benchmarks.generate bench.db
+#   python -m benchmarks.render bench.db --requests 500
+import argparse
+import importlib
+import json
+import os
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+from benchmarks.load import percentile
+
+# Pages to render, requested with a session so the page cache is skipped
+PAGES = ["/", "/search?search_term=lavender", "/about", "/faqs"]
+
+
+def render_times(app, path, requests):
+    """
+    Returns percentiles of the time to produce the whole page. Search is
+    streamed, so its render time can't come from Server-Timing, which is
+    sent before the body; wall time covers every page the same way.
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["userid"] = 1
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(path).get_data()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {name: round(percentile(timings, fraction) * 1000, 3)
+            for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95),
+                                   ("p99_ms", 0.99))}
+
+
+def cold_load(app, bytecode_cache):
+    """
+    Seconds a fresh Jinja environment takes to load every template.
+    """
+    env = app.jinja_env.overlay(cache_size=0, bytecode_cache=bytecode_cache)
+    start = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        env.get_template(name)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render time with and without template caches")
+    parser.add_argument("database", help="database to run against")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per page and setting")
+    args = parser.parse_args()
+
+    os.environ["SOAP_DATABASE"] = args.database
+    app = importlib.import_module("routes").app
+    fragments = importlib.import_module("fragments")
+
+    report = {"render": {}}
+    for setting, budget in (("without_fragment_cache", 0),
+                            ("with_fragment_cache",
+                             fragments.DEFAULT_FRAGMENT_CACHE_BYTES)):
+        app.extensions["soap_fragment_cache"] = \
+            fragments.FragmentCache(budget)
+        report["render"][setting] = {
+            path: render_times(app, path, args.requests) for path in PAGES}
+        report["render"][setting]["fragment_cache"] = \
+            app.extensions["soap_fragment_cache"].stats()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bytecode_cache = FileSystemBytecodeCache(directory)
+        # The first load fills the cache, the second is a warm restart
+        cold_load(app, bytecode_cache)
+        report["cold_template_load_ms"] = {
+            "without_bytecode_cache": round(cold_load(app, None) * 1000, 3),
+            "with_bytecode_cache": round(
+                cold_load(app, bytecode_cache) * 1000, 3),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Micro-benchmarks for the search suggestion index: build time, memory,
+# lookup latency for typed prefixes, and the cost of applying a small
+# catalog change, at catalog sizes of 100k soaps and up
+#
+# Needs no database; soaps come from the same generator as generate.py.
+# Run from the repository root, for example:
+#   python -m benchmarks.suggest --soaps 100000 250000 --lookups 20000
+import argparse
+import json
+import random
+import threading
+import time
+
+from benchmarks.generate import WORDS, soaps
+from benchmarks.load import percentile
+from catalog import Soap
+from suggest import SuggestIndex
+
+# Queries as typed: whole words cut short, and a second word being typed
+QUERY_SHAPES = ["{0:.1}", "{0:.2}", "{0:.3}", "{0}", "{0} {1:.2}",
+                "{0} {1}", "{0:.3} {1:.1}"]
+
+
+def generate(count, seed):
+    rng = random.Random(seed)
+    return [Soap(*row) for row in soaps(rng, count, ["/static/a.jpg"])]
+
+
+def lookup_times(index, lookups, limit, rng):
+    """
+    Returns percentiles of one lookup's time, in microseconds.
+    """
+    queries = [rng.choice(QUERY_SHAPES).format(*rng.sample(WORDS, 2))
+               for _ in range(lookups)]
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.suggest(query, limit)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {name: round(percentile(timings, fraction) * 1e6, 1)
+            for name, fraction in (("p50_us", 0.50), ("p95_us", 0.95),
+                                   ("p99_us", 0.99),
+                                   ("max_us", 1.0))}
+
+
+def update_time(index, catalog, changes, rng):
+    """
+    Milliseconds to apply a catalog version where `changes` soaps were
+    renamed, compared with rebuilding the index from scratch, and the
+    longest a lookup made meanwhile took.
+    """
+    changed = list(catalog)
+    for position in rng.sample(range(len(changed)), changes):
+        soap = changed[position]
+        changed[position] = soap._replace(
+            name=f"{rng.choice(WORDS).title()} Special {soap.soapid}")
+
+    # Look up from another thread meanwhile, to see how long the update
+    # holds lookups up
+    stalls, done = [], threading.Event()
+
+    def look_up():
+        while not done.is_set():
+            start = time.perf_counter()
+            index.suggest("a")
+            stalls.append(time.perf_counter() - start)
+
+    reader = threading.Thread(target=look_up)
+    reader.start()
+    start = time.perf_counter()
+    index.update(changed, version=2)
+    incremental = time.perf_counter() - start
+    done.set()
+    reader.join()
+
+    start = time.perf_counter()
+    SuggestIndex(changed, version=2)
+    rebuild = time.perf_counter() - start
+    return {"changed_soaps": changes,
+            "incremental_ms": round(incremental * 1000, 3),
+            "longest_lookup_ms": round(max(stalls) * 1000, 3),
+            "rebuild_ms": round(rebuild * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Suggestion index build, memory and lookup latency")
+    parser.add_argument("--soaps", type=int, nargs="+",
+                        default=[100000, 250000],
+                        help="catalog sizes to measure")
+    parser.add_argument("--lookups", type=int, default=20000,
+                        help="lookups per catalog size")
+    parser.add_argument("--limit", type=int, default=8,
+                        help="suggestions per lookup")
+    parser.add_argument("--changes", type=int, default=100,
+                        help="soaps changed in the update test")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    report = {}
+    for count in args.soaps:
+        rng = random.Random(args.seed)
+        catalog = generate(count, args.seed)
+        index = SuggestIndex(catalog, version=1)
+        report[count] = {
+            "index": index.stats(),
+            "lookup": lookup_times(index, args.lookups, args.limit, rng),
+            "update": update_time(index, catalog, args.changes, rng),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# Cart service: every change to a user's cart runs as one transaction.
+# A user with nothing in their cart has no Cart row; it is created with
+# the first item, so viewing an empty cart never writes
+import time
+
+import click
+
+import db
+
+# Empty open carts younger than this are left alone by the cleanup job
+DEFAULT_CLEANUP_MIN_AGE_HOURS = 24
+
+# Largest quantity SQLite can store, the cap when no other is given
+MAX_QUANTITY = 2 ** 63 - 1
+
+
+def open_cart_id(connection, userid, create=False):
+    """
+    Returns the id of the user's open cart. If there isn't one, creates
+    it when `create` is set, otherwise returns None.
+    """
+    sql = "SELECT cartid FROM Cart WHERE userid = ? AND status = 'open'"
+    cart = connection.execute(sql, (userid,)).fetchone()
+    if cart:
+        return cart[0]
+    if not create:
+        return None
+
+    sql = """INSERT INTO Cart (userid, order_date, status)
+             VALUES (?, datetime('now'), 'open') RETURNING cartid"""
+    return connection.execute(sql, (userid,)).fetchall()[0][0]
+
+
+def contents(userid):
+    """
+    Returns the id of the user's open cart and its lines as
+    (soapid, name, unit_price, quantity). Without an open cart this is
+    (None, []), and nothing is written.
+    """
+    connection = db.reader()
+    cartid = open_cart_id(connection, userid)
+    if cartid is None:
+        return None, []
+
+    sql = """SELECT Soap.soapid, Soap.name, Soap.price, CartItem.quantity
+             FROM CartItem
+             JOIN Soap ON Soap.soapid = CartItem.soapid
+             WHERE CartItem.cartid = ?"""
+    return cartid, connection.execute(sql, (cartid,)).fetchall()
+
+
+def quantities(userid, soapids):
+    """
+    Returns {soapid: quantity} for those of the given soaps that are in
+    the user's open cart.
+    """
+    if not soapids:
+        return {}
+    placeholders = ", ".join("?" * len(soapids))
+    sql = f"""SELECT CartItem.soapid, CartItem.quantity
+              FROM Cart
+              JOIN CartItem ON CartItem.cartid = Cart.cartid
+              WHERE Cart.userid = ? AND Cart.status = 'open'
+              AND CartItem.soapid IN ({placeholders})"""
+    return dict(db.reader().execute(sql, (userid, *soapids)).fetchall())
+
+
+def add_item(userid, soapid):
+    """
+    Adds one of a soap to the user's open cart, creating the cart if
+    needed. Returns the new quantity of that soap in the cart.
+    """
+    with db.write_transaction() as connection:
+        cartid = open_cart_id(connection, userid, create=True)
+        sql = """INSERT INTO CartItem (cartid, soapid, quantity)
+                 VALUES (?, ?, 1)
+                 ON CONFLICT (cartid, soapid)
+                 DO UPDATE SET quantity = quantity + 1
+                 RETURNING quantity"""
+        return connection.execute(sql, (cartid, soapid)).fetchall()[0][0]
+
+
+def remove_item(userid, soapid):
+    """
+    Takes one of a soap out of the user's open cart, deleting the line
+    when it reaches zero. Returns the new quantity, or None if the soap
+    wasn't in the cart.
+    """
+    with db.write_transaction() as connection:
+        sql = """UPDATE CartItem SET quantity = quantity - 1
+                 WHERE soapid = ? AND cartid = (
+                     SELECT cartid FROM Cart
+                     WHERE userid = ? AND status = 'open'
+                 )
+                 RETURNING cartid, quantity"""
+        rows = connection.execute(sql, (soapid, userid)).fetchall()
+        if not rows:
+            return None
+
+        cartid, quantity = rows[0]
+        if quantity <= 0:
+            sql = "DELETE FROM CartItem WHERE cartid = ? AND soapid = ?"
+            connection.execute(sql, (cartid, soapid))
+            quantity = 0
+        return quantity
+
+
+def update_items(userid, quantities=None, changes=None, maximum=None):
+    """
+    Sets and adjusts many lines of the user's open cart in one
+    transaction. `quantities` maps soapid to a new quantity and
+    `changes` maps soapid to an amount to add (or take away). Lines that
+    reach zero are deleted, and additions stop at `maximum`, if given.
+    Returns {soapid: new quantity} for every soap named.
+
+    Simplified explanation:
+    - Each kind of change is one executemany, so a batch costs one
+      transaction however many soaps it touches.
+    - The cart is only created when something is being added to it.
+    """
+    quantities = quantities or {}
+    changes = changes or {}
+    soapids = list(quantities.keys() | changes.keys())
+    if not soapids:
+        return {}
+
+    adding = any(quantity > 0 for quantity in quantities.values()) \
+        or any(change > 0 for change in changes.values())
+    with db.write_transaction() as connection:
+        cartid = open_cart_id(connection, userid, create=adding)
+        if cartid is None:
+            return dict.fromkeys(soapids, 0)
+
+        sql = """INSERT INTO CartItem (cartid, soapid, quantity)
+                 VALUES (?, ?, ?)
+                 ON CONFLICT (cartid, soapid)
+                 DO UPDATE SET quantity = excluded.quantity"""
+        connection.executemany(sql, [
+            (cartid, soapid, quantity)
+            for soapid, quantity in quantities.items()])
+
+        # The cap is applied to the sum, inside the transaction, so
+        # repeated or concurrent additions can't take a line past it
+        sql = """INSERT INTO CartItem (cartid, soapid, quantity)
+                 VALUES (?, ?, MIN(?, ?))
+                 ON CONFLICT (cartid, soapid)
+                 DO UPDATE SET quantity = MIN(quantity + excluded.quantity,
+                                              ?)"""
+        limit = maximum if maximum is not None else MAX_QUANTITY
+        connection.executemany(sql, [
+            (cartid, soapid, change, limit, limit)
+            for soapid, change in changes.items()])
+
+        placeholders = ", ".join("?" * len(soapids))
+        sql = f"""DELETE FROM CartItem
+                  WHERE cartid = ? AND soapid IN ({placeholders})
+                  AND quantity <= 0"""
+        connection.execute(sql, (cartid, *soapids))
+
+        sql = f"""SELECT soapid, quantity FROM CartItem
+                  WHERE cartid = ? AND soapid IN ({placeholders})"""
+        current = dict(connection.execute(sql, (cartid, *soapids)).fetchall())
+    return {soapid: current.get(soapid, 0) for soapid in soapids}
+
+
+def delete_empty_carts(batch_size, min_age_hours, pause=0.0):
+    """
+    Deletes open carts that have no items, walking the Cart table in
+    cartid ranges of `batch_size` with one short transaction per range.
+    Yields (cartid reached, carts deleted so far) after each range.
+
+    Simplified explanation:
+    - Each range is a primary-key range scan, so no transaction holds
+      the write lock for long however big the table is.
+    - A cart that gets an item first is kept: add_item finds the cart
+      and inserts the item in one transaction.
+    """
+    sql = "SELECT COALESCE(MAX(cartid), 0) FROM Cart"
+    last = db.reader().execute(sql).fetchone()[0]
+
+    sql = """DELETE FROM Cart
+             WHERE cartid > ? AND cartid <= ? AND status = 'open'
+             AND order_date < datetime('now', ?)
+             AND NOT EXISTS (
+                 SELECT 1 FROM CartItem WHERE CartItem.cartid = Cart.cartid
+             )"""
+    age = f"-{min_age_hours} hours"
+    deleted = 0
+    for start in range(0, last, batch_size):
+        with db.write_transaction() as connection:
+            deleted += connection.execute(
+                sql, (start, start + batch_size, age)).rowcount
+        yield min(start + batch_size, last), deleted
+        if pause:
+            time.sleep(pause)
+
+
+@click.group("cart")
+def cart_cli():
+    """Cart maintenance commands."""
+
+
+@cart_cli.command("cleanup")
+@click.option("--batch-size", default=1000, show_default=True,
+              help="Cart ids per transaction.")
+@click.option("--min-age-hours", default=DEFAULT_CLEANUP_MIN_AGE_HOURS,
+              show_default=True)
+@click.option("--pause", default=0.05, show_default=True,
+              help="Seconds to wait between batches.")
+def cleanup_command(batch_size, min_age_hours, pause):
+    """Remove open carts that have no items."""
+    deleted = 0
+    for reached, deleted in delete_empty_carts(batch_size, min_age_hours,
+                                               pause):
+        click.echo(f"Checked up to cart {reached}, "
+                   f"deleted {deleted}", err=True)
+    click.echo(f"Deleted {deleted} empty carts")
+
+
+def init_app(app):
+    """
+    Registers the `flask cart` commands.
+    """
+    app.cli.add_command(cart_cli)
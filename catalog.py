@@ -0,0 +1,103 @@
+# In-process cache of the Soap catalog, reloaded only when the catalog
+# version stored in the database changes
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import g
+
+import db
+
+# One compact, immutable record per soap
+Soap = namedtuple("Soap", "soapid name description price picture is_featured")
+
+
+class CatalogSnapshot:
+    """
+    All soaps as loaded at one catalog version, with the views the
+    pages need already built.
+    """
+
+    __slots__ = ("version", "by_id", "featured", "gallery")
+
+    def __init__(self, version, soaps):
+        self.version = version
+        self.by_id = {soap.soapid: soap for soap in soaps}
+        self.featured = tuple(soap for soap in soaps if soap.is_featured)
+        self.gallery = tuple(soaps)
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def current_version(connection=None):
+    """
+    Reads the catalog version and when it last changed, at most once
+    per request.
+    """
+    if "catalog_version" not in g:
+        connection = connection or db.reader()
+        row = connection.execute(
+            "SELECT version, updated_at FROM CatalogVersion WHERE id = 1"
+        ).fetchone()
+        g.catalog_version, g.catalog_updated_at = row if row else (0, None)
+    return g.catalog_version
+
+
+def updated_at():
+    """
+    Returns when the catalog last changed, as a UTC datetime (or None).
+    """
+    current_version()
+    if not g.catalog_updated_at:
+        return None
+    return datetime.fromisoformat(g.catalog_updated_at).replace(
+        tzinfo=timezone.utc)
+
+
+def get_catalog():
+    """
+    Returns the cached catalog, reloading it first if the version in the
+    database has moved on since it was loaded.
+    """
+    global _snapshot
+    connection = db.reader()
+    version = current_version(connection)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _lock:
+        # Another thread may have reloaded while we waited for the lock
+        if _snapshot is None or _snapshot.version != version:
+            rows = connection.execute(
+                "SELECT soapid, name, description, price, picture, \
+                    is_featured FROM Soap ORDER BY soapid").fetchall()
+            _snapshot = CatalogSnapshot(version, [Soap(*row) for row in rows])
+        return _snapshot
+
+
+def featured():
+    return get_catalog().featured
+
+
+def gallery():
+    return get_catalog().gallery
+
+
+def lookup(soapid):
+    """
+    Returns the Soap with this id, or None if there isn't one.
+    """
+    try:
+        return get_catalog().by_id.get(int(soapid))
+    except (TypeError, ValueError):
+        return None
+
+
+def invalidate():
+    # Drops the cached catalog so the next request reloads it
+    global _snapshot
+    _snapshot = None
+
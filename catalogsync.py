@@ -0,0 +1,283 @@
+# Bulk catalog sync: `flask catalog import` and `flask catalog export`
+# stream CSV or JSONL through generators, so memory use stays flat
+# however many products are in the file or the table
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+import time
+
+import click
+from flask import current_app
+
+import db
+import migrations
+
+# Columns in import and export files, in this order
+COLUMNS = ["soapid", "name", "description", "price", "picture",
+           "is_featured"]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+UPSERT_SQL = """INSERT INTO Soap
+    (soapid, name, description, price, picture, is_featured)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (soapid) DO UPDATE SET
+        name = excluded.name, description = excluded.description,
+        price = excluded.price, picture = excluded.picture,
+        is_featured = excluded.is_featured"""
+
+INSERT_SQL = """INSERT INTO Soap
+    (name, description, price, picture, is_featured)
+    VALUES (?, ?, ?, ?, ?)"""
+
+# Run once after a load, since Soap's triggers are off while it runs
+REBUILD_SEARCH_SQL = "INSERT INTO SoapSearch (SoapSearch) VALUES ('rebuild')"
+BUMP_VERSION_SQL = """UPDATE CatalogVersion
+    SET version = version + 1, updated_at = datetime('now')
+    WHERE id = 1"""
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def file_format(path, given):
+    if given:
+        return given
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def open_file(path, mode="r"):
+    # click.open_file handles "-" but can't turn off newline translation,
+    # which the csv module needs for quoted multi-line descriptions
+    if path == "-":
+        return click.open_file(path, mode)
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def read_rows(file, fmt):
+    """
+    Yields (line number, record) for each record in the file. CSV
+    records are dicts; JSONL lines are yielded as text and parsed by
+    validate(), so a line that isn't JSON is rejected like any bad row.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for lineno, line in enumerate(file, 1):
+            if line.strip():
+                yield lineno, line
+
+
+def parse_line(line):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise InvalidRow(f"not valid JSON ({e.msg})")
+    if not isinstance(record, dict):
+        raise InvalidRow("not a JSON object")
+    return record
+
+
+def _flag(value):
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("", "0", "false", "no"):
+            return 0
+        if value in ("1", "true", "yes"):
+            return 1
+        raise InvalidRow(f"is_featured must be true or false, not {value!r}")
+    return 1 if value else 0
+
+
+def _text(record, field):
+    # JSONL values can be any type; only text (or nothing) is accepted
+    value = record.get(field)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise InvalidRow(f"{field} must be text")
+    return value.strip()
+
+
+def validate(record, static_folder):
+    """
+    Checks one record and returns (soapid or None, row values, warning).
+    Raises InvalidRow if it can't be imported.
+    """
+    if isinstance(record, str):
+        record = parse_line(record)
+    name = _text(record, "name")
+    if not name or len(name) > 100:
+        raise InvalidRow("name must be between 1 and 100 characters")
+
+    try:
+        price = round(float(record.get("price")), 2)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"price {record.get('price')!r} is not a number")
+    if not math.isfinite(price):
+        raise InvalidRow(f"price {record.get('price')!r} is not a number")
+    if price < 0:
+        raise InvalidRow("price can't be negative")
+
+    soapid = record.get("soapid")
+    if soapid in (None, ""):
+        soapid = None
+    else:
+        try:
+            soapid = int(soapid)
+        except (TypeError, ValueError):
+            raise InvalidRow(f"soapid {soapid!r} is not a whole number")
+        # SQLite integers are 64-bit
+        if not -2 ** 63 <= soapid < 2 ** 63:
+            raise InvalidRow(f"soapid {soapid} is out of range")
+
+    warning = None
+    picture = _text(record, "picture") or None
+    if picture:
+        # Pictures are stored as /static/... URLs
+        relative = picture.split("/static/", 1)[-1]
+        if not os.path.isfile(os.path.join(static_folder, relative)):
+            warning = f"picture {picture} is not in static/"
+
+    description = _text(record, "description") or None
+    return soapid, (name, description, price, picture,
+                    _flag(record.get("is_featured"))), warning
+
+
+def chunked(rows, size):
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _soap_schema(connection):
+    # Secondary indexes and the search and catalog-version triggers on Soap
+    return connection.execute(
+        """SELECT type, name, sql FROM sqlite_master
+           WHERE tbl_name = 'Soap' AND sql IS NOT NULL
+           AND type IN ('index', 'trigger')""").fetchall()
+
+
+@click.group("catalog")
+def catalog_cli():
+    """Bulk catalog import and export."""
+
+
+@catalog_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]),
+              help="Defaults to the file extension.")
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option("--strict-pictures", is_flag=True,
+              help="Reject rows whose picture isn't in static/.")
+def import_command(path, fmt, chunk_size, strict_pictures):
+    """Upsert products from a CSV or JSONL file."""
+    # A connection of our own: the load runs as many transactions
+    connection = db.open_connection(current_app)
+    static_folder = current_app.static_folder
+    counts = {"imported": 0, "rejected": 0, "missing_pictures": 0}
+
+    def valid_rows(records):
+        for lineno, record in records:
+            try:
+                soapid, values, warning = validate(record, static_folder)
+            except InvalidRow as e:
+                counts["rejected"] += 1
+                click.echo(f"line {lineno}: {e}", err=True)
+                continue
+            if warning:
+                counts["missing_pictures"] += 1
+                click.echo(f"line {lineno}: {warning}", err=True)
+                if strict_pictures:
+                    counts["rejected"] += 1
+                    continue
+            yield soapid, values
+
+    # Drop Soap's indexes and triggers for the load. Putting them back,
+    # rebuilding the search index and bumping the catalog version (the
+    # triggers were off) are recorded in the same transaction, so they
+    # still happen if the import is killed: by the next import, or by
+    # `flask db upgrade` and server startup
+    migrations.run_deferred(connection)
+    deferred = _soap_schema(connection)
+    migrations.defer_statements(
+        connection,
+        [f'DROP {kind.upper()} "{name}"' for kind, name, _ in deferred],
+        [sql for _, _, sql in deferred] + [REBUILD_SEARCH_SQL,
+                                          BUMP_VERSION_SQL])
+
+    start = time.perf_counter()
+    fmt = file_format(path, fmt)
+    try:
+        with open_file(path) as file:
+            for chunk in chunked(valid_rows(read_rows(file, fmt)),
+                                 chunk_size):
+                with db.transaction(connection):
+                    connection.executemany(UPSERT_SQL, [
+                        (soapid,) + values for soapid, values in chunk
+                        if soapid is not None])
+                    connection.executemany(INSERT_SQL, [
+                        values for soapid, values in chunk
+                        if soapid is None])
+                counts["imported"] += len(chunk)
+                elapsed = time.perf_counter() - start
+                click.echo(f"{counts['imported']} rows "
+                           f"({counts['imported'] / elapsed:.0f} rows/s)",
+                           err=True)
+    finally:
+        migrations.run_deferred(connection)
+        connection.close()
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"Imported {counts['imported']} rows in {elapsed:.1f}s "
+               f"({counts['imported'] / max(elapsed, 1e-9):.0f} rows/s), "
+               f"rejected {counts['rejected']}, "
+               f"missing pictures {counts['missing_pictures']}")
+    if counts["rejected"]:
+        sys.exit(1)
+
+
+@catalog_cli.command("export")
+@click.argument("path", type=click.Path(allow_dash=True), default="-")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]),
+              help="Defaults to the file extension.")
+def export_command(path, fmt):
+    """Write every product to a CSV or JSONL file (or stdout)."""
+    fmt = file_format(path, fmt)
+    # Iterating the cursor streams rows instead of loading the table
+    rows = db.reader().execute(
+        f"SELECT {', '.join(COLUMNS)} FROM Soap ORDER BY soapid")
+
+    start = time.perf_counter()
+    count = 0
+    with open_file(path, "w") as file:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(dict(zip(COLUMNS, row))) + "\n")
+                count += 1
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"Exported {count} rows in {elapsed:.1f}s "
+               f"({count / max(elapsed, 1e-9):.0f} rows/s)", err=True)
+
+
+def init_app(app):
+    """
+    Registers the `flask catalog` commands.
+    """
+    app.cli.add_command(catalog_cli)
@@ -0,0 +1,176 @@
+# Compression of dynamic responses: HTML and JSON above a size threshold
+# are sent gzip- or brotli-encoded, and streamed pages are compressed
+# chunk by chunk as they are rendered
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this many bytes aren't worth compressing
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+
+# zlib level 1-9 for gzip and quality 0-11 for brotli: higher levels
+# give smaller responses for more CPU per request
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_COMPRESS_BROTLI_LEVEL = 4
+
+# Content types that are compressed
+COMPRESS_MIMETYPES = {"text/html", "application/json", "text/plain"}
+
+# A streamed page is compressed and flushed once this much has been
+# rendered, so the browser still gets it in pieces
+STREAM_FLUSH_BYTES = 8192
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer around the deflate data
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def accepted_encoding():
+    """
+    Returns the best encoding the client accepts, or None.
+    """
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def new_encoder(encoding):
+    config = current_app.config
+    if encoding == "br":
+        return BrotliEncoder(config["COMPRESS_BROTLI_LEVEL"])
+    return GzipEncoder(config["COMPRESS_LEVEL"])
+
+
+def choose_encoding(mimetype, size=None):
+    """
+    Returns the encoding to send a body of this type and size (None if
+    it is streamed) with, or None to send it as it is.
+    """
+    config = current_app.config
+    if not config["COMPRESS_ENABLED"] \
+            or mimetype not in COMPRESS_MIMETYPES \
+            or (size is not None and size < config["COMPRESS_MIN_SIZE"]):
+        return None
+    return accepted_encoding()
+
+
+def compress(data, encoding):
+    encoder = new_encoder(encoding)
+    return encoder.compress(data) + encoder.finish()
+
+
+def compress_stream(chunks, encoder):
+    """
+    Compresses a streamed body as it is produced. Chunks are collected
+    until STREAM_FLUSH_BYTES have built up, then flushed, so each piece
+    the client receives can be decoded straight away.
+    """
+    output = []
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            output.append(encoder.compress(chunk))
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                output.append(encoder.flush())
+                yield b"".join(output)
+                output = []
+                pending = 0
+        output.append(encoder.finish())
+        yield b"".join(output)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response):
+    """
+    Compresses the response if it is a compressible type, big enough
+    (or streamed, where the size isn't known) and the client accepts an
+    encoding.
+
+    Simplified explanation:
+    - The ETag is made weak, because the bytes differ from the
+      uncompressed page while the content is the same.
+    - Vary: Accept-Encoding tells caches that the answer depends on it.
+    """
+    if not current_app.config["COMPRESS_ENABLED"] \
+            or request.endpoint == "static" \
+            or response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200 or request.method == "HEAD" \
+            or "Content-Encoding" in response.headers \
+            or response.direct_passthrough:
+        return response
+
+    size = None if response.is_streamed \
+        else response.calculate_content_length()
+    encoding = choose_encoding(response.mimetype, size)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response,
+                                            new_encoder(encoding))
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    weaken_etag(response)
+    return response
+
+
+def weaken_etag(response):
+    # The compressed bytes differ from the page, the content doesn't
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def init_app(app):
+    """
+    Registers the compression defaults and the hook that compresses
+    responses.
+    """
+    app.config.setdefault("COMPRESS_ENABLED", True)
+    app.config.setdefault("COMPRESS_MIN_SIZE", DEFAULT_COMPRESS_MIN_SIZE)
+    app.config.setdefault("COMPRESS_LEVEL", DEFAULT_COMPRESS_LEVEL)
+    app.config.setdefault("COMPRESS_BROTLI_LEVEL",
+                          DEFAULT_COMPRESS_BROTLI_LEVEL)
+    app.after_request(compress_response)
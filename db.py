@@ -0,0 +1,272 @@
+# Connection management for the SQLite database. Reads and writes take
+# separate paths:
+# - reads use a small pool of read-only connections, handed out per
+#   request through Flask's app context; they never take the write lock
+# - writes go through one connection per process, one transaction at a
+#   time, retrying when another process holds SQLite's write lock
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+from flask import g, current_app
+
+import metrics
+
+# Defaults used when the app config doesn't set them
+DEFAULT_DATABASE = "Soap.db"
+DEFAULT_POOL_SIZE = 8
+DEFAULT_BUSY_TIMEOUT = 5000
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+DEFAULT_CACHE_SIZE = -16000
+DEFAULT_WRITE_ATTEMPTS = 5
+DEFAULT_WRITE_BACKOFF = 0.05
+
+# Pragmas applied once to every new connection
+CONNECTION_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", "DB_BUSY_TIMEOUT"),
+    ("mmap_size", "DB_MMAP_SIZE"),
+    ("cache_size", "DB_CACHE_SIZE"),
+)
+
+# Pragmas that change the database file, which read-only connections
+# can't set (WAL mode sticks once the writer has set it)
+WRITE_PRAGMAS = {"journal_mode"}
+
+# Errors that mean another connection holds the write lock
+BUSY_ERRORS = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+# Guards creating each app's writer, which request threads may race to do
+_writer_lock = threading.Lock()
+
+
+def connect(database, pragmas=(), readonly=False):
+    """
+    Opens a connection with the given pragmas. Read-only connections are
+    opened with a mode=ro URI, so SQLite itself refuses any write.
+    """
+    if readonly:
+        uri = pathlib.Path(database).absolute().as_uri() + "?mode=ro"
+        pragmas = [(name, value) for name, value in pragmas
+                   if name not in WRITE_PRAGMAS]
+    # Connections move between worker threads, so the same-thread
+    # check is turned off; each one is only used by one thread at a time
+    connection = sqlite3.connect(uri if readonly else database,
+                                 uri=readonly, check_same_thread=False,
+                                 factory=metrics.InstrumentedConnection)
+    for name, value in pragmas:
+        connection.execute(f"PRAGMA {name} = {value}")
+    return connection
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` idle read-only connections ready for reuse.
+
+    Simplified explanation:
+    - acquire() hands out an idle connection, or opens a new one.
+    - release() puts it back, or closes it if the pool is already full.
+    - Pragmas are only set when a connection is first opened.
+    """
+
+    def __init__(self, database, size, pragmas=()):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self._idle = Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self):
+        connection = connect(self.database, self.pragmas, readonly=True)
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def release(self, connection):
+        # Roll back anything a failed request left uncommitted
+        if connection.in_transaction:
+            connection.rollback()
+        try:
+            self._idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
+class Writer:
+    """
+    The process's single write connection.
+
+    Simplified explanation:
+    - Threads take turns on a lock, so writes from one process queue
+      here instead of contending for SQLite's file lock.
+    - The connection is opened on first use, after any worker fork.
+    """
+
+    def __init__(self, database, pragmas, attempts, backoff):
+        self.database = database
+        self.pragmas = pragmas
+        self.attempts = attempts
+        self.backoff = backoff
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._connection is None:
+                self._connection = connect(self.database, self.pragmas)
+            with transaction(self._connection, self.attempts,
+                             self.backoff) as connection:
+                yield connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _pragmas(app):
+    return [(name, app.config[value] if value in app.config else value)
+            for name, value in CONNECTION_PRAGMAS]
+
+
+def _pool_for(app):
+    pool = app.extensions.get("soap_db_pool")
+    if pool is None:
+        pool = ConnectionPool(app.config["DATABASE"],
+                              app.config["DB_POOL_SIZE"], _pragmas(app))
+        app.extensions["soap_db_pool"] = pool
+    return pool
+
+
+def _writer_for(app):
+    writer = app.extensions.get("soap_db_writer")
+    if writer is None:
+        with _writer_lock:
+            writer = app.extensions.get("soap_db_writer")
+            if writer is None:
+                writer = Writer(app.config["DATABASE"], _pragmas(app),
+                                app.config["DB_WRITE_ATTEMPTS"],
+                                app.config["DB_WRITE_BACKOFF"])
+                app.extensions["soap_db_writer"] = writer
+    return writer
+
+
+def close_connections(app):
+    """
+    Closes the app's connections and forgets them, so the next request
+    opens new ones. SQLite connections can't be carried across a fork,
+    so this runs before worker processes are started.
+    """
+    pool = app.extensions.pop("soap_db_pool", None)
+    if pool is not None:
+        pool.close_all()
+    writer = app.extensions.pop("soap_db_writer", None)
+    if writer is not None:
+        writer.close()
+
+
+def open_connection(app):
+    """
+    Opens a standalone writable connection with the usual pragmas, for
+    CLI commands that manage their own transactions.
+    """
+    return connect(app.config["DATABASE"], _pragmas(app))
+
+
+def reader():
+    """
+    Returns the read-only connection for the current app context,
+    taking one from the pool the first time it is needed.
+    """
+    if "db" not in g:
+        g.db = _pool_for(current_app).acquire()
+    return g.db
+
+
+def write_transaction(app=None):
+    """
+    Runs the enclosed statements as one transaction on the process's
+    writer connection:
+
+        with db.write_transaction() as connection:
+            connection.execute(...)
+
+    `app` is only needed outside an app context, e.g. from a thread.
+    """
+    return _writer_for(app or current_app).transaction()
+
+
+def close_db(exception=None):
+    # Hands the request's connection back to the pool on teardown
+    connection = g.pop("db", None)
+    if connection is not None:
+        _pool_for(current_app).release(connection)
+
+
+def _begin(connection, attempts, backoff):
+    # busy_timeout already waits inside SQLite; past that, back off and
+    # try again rather than failing the request straight away
+    for attempt in range(attempts):
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode not in BUSY_ERRORS or \
+                    attempt == attempts - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+@contextmanager
+def transaction(connection, attempts=DEFAULT_WRITE_ATTEMPTS,
+                backoff=DEFAULT_WRITE_BACKOFF):
+    """
+    Runs the enclosed statements as one write transaction.
+
+    Simplified explanation:
+    - BEGIN IMMEDIATE takes the write lock up front, so two requests
+      can't both read a value and then overwrite each other's update.
+    - If the lock stays busy, BEGIN is retried with exponential backoff.
+    - Commits if the block finishes, rolls back if it raises.
+    """
+    _begin(connection, attempts, backoff)
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+def init_app(app):
+    """
+    Registers config defaults and the teardown handler on the app.
+    """
+    app.config.setdefault("DATABASE", DEFAULT_DATABASE)
+    app.config.setdefault("DB_POOL_SIZE", DEFAULT_POOL_SIZE)
+    app.config.setdefault("DB_BUSY_TIMEOUT", DEFAULT_BUSY_TIMEOUT)
+    app.config.setdefault("DB_MMAP_SIZE", DEFAULT_MMAP_SIZE)
+    app.config.setdefault("DB_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+    app.config.setdefault("DB_WRITE_ATTEMPTS", DEFAULT_WRITE_ATTEMPTS)
+    app.config.setdefault("DB_WRITE_BACKOFF", DEFAULT_WRITE_BACKOFF)
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,120 @@
+# Template caching: a Jinja bytecode cache on disk, so fresh workers skip
+# compiling templates, and an in-memory cache of rendered HTML fragments
+# that only depend on the catalog
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+import catalog
+import manifests
+
+# Default memory budget for cached fragments, in bytes of HTML
+DEFAULT_FRAGMENT_CACHE_BYTES = 4 * 1024 * 1024
+
+# The site is only written in English for now
+DEFAULT_LOCALE = "en"
+
+
+class FragmentCache:
+    """
+    Least-recently-used cache of rendered HTML, bounded by total size.
+
+    Simplified explanation:
+    - Keys include the catalog version and the asset and image builds,
+      so a change to the Soap table or a new build makes every entry
+      stale; they are dropped together.
+    - A budget of 0 bytes turns the cache off.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = html
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear_if_stale(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.bytes = 0
+                self.version = version
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes,
+                "hits": self.hits, "misses": self.misses}
+
+
+def cached_fragment(name, *vary, caller):
+    """
+    Template helper that renders its block once per catalog version,
+    asset and image build and locale and reuses the HTML after that:
+
+        {% call cached_fragment("gallery") %} ... {% endcall %}
+
+    Anything else the block depends on must be passed in `vary`. Blocks
+    that read the session or flashed messages can't be cached this way.
+    """
+    cache = current_app.extensions["soap_fragment_cache"]
+    version = (catalog.current_version(),
+               manifests.versions(current_app))
+    cache.clear_if_stale(version)
+    key = (name, vary, version, current_app.config["LOCALE"])
+
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.put(key, html)
+    return Markup(html)
+
+
+def init_app(app):
+    """
+    Registers the cache defaults, turns on the bytecode cache and adds
+    the fragment helper to templates.
+    """
+    app.config.setdefault("TEMPLATE_CACHE_DIR",
+                          os.path.join(app.instance_path, "jinja_cache"))
+    app.config.setdefault("FRAGMENT_CACHE_BYTES",
+                          DEFAULT_FRAGMENT_CACHE_BYTES)
+    app.config.setdefault("LOCALE", DEFAULT_LOCALE)
+
+    # An empty TEMPLATE_CACHE_DIR leaves the bytecode cache off
+    directory = app.config["TEMPLATE_CACHE_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    app.extensions["soap_fragment_cache"] = FragmentCache(
+        app.config["FRAGMENT_CACHE_BYTES"])
+    app.jinja_env.globals["cached_fragment"] = cached_fragment
@@ -0,0 +1,158 @@
+# Full-text search over the Soap catalog using an SQLite FTS5 index
+import base64
+import json
+import re
+from collections import namedtuple
+
+import db
+
+# Default number of results per search page
+DEFAULT_PAGE_SIZE = 24
+
+# Columns each sort option orders by, and whether it runs high to low.
+# soapid comes last so every row has a unique position to resume from;
+# name matches rank ten times higher than description matches
+SORT_KEYS = {
+    "ascending": (["Soap.price", "Soap.soapid"], False),
+    "descending": (["Soap.price", "Soap.soapid"], True),
+    "alpha": (["Soap.name", "Soap.soapid"], False),
+    "relevance": (["bm25(SoapSearch, 10.0, 1.0)", "Soap.soapid"], False),
+    "": (["Soap.soapid"], False),
+}
+
+# One page of results, with the cursors for the pages either side
+# (None when there is no such page)
+SearchPage = namedtuple("SearchPage", "soapids previous_cursor next_cursor")
+
+
+def encode_cursor(values):
+    """
+    Turns the sort key of a row into an opaque, URL-safe cursor.
+    """
+    data = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor. Returns None for a missing or malformed
+    cursor, which simply starts from the first page. search_soaps
+    checks that the number of values matches the sort.
+    """
+    if not cursor:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(values, list) \
+            or not all(_cursor_value(value) for value in values):
+        return None
+    return values
+
+
+def _cursor_value(value):
+    # Only values SQLite can bind and a sort key could hold: text, real
+    # numbers and 64-bit integers (bool is an int, but never a key)
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return isinstance(value, (float, str))
+
+
+def build_match_query(search_term):
+    """
+    Turns free text into an FTS5 query where every word must match,
+    and the words are treated as prefixes (so "lav" finds "Lavender").
+    Returns None if the text has no searchable words.
+    """
+    words = re.findall(r"\w+", search_term)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_soaps(search_term, sort_option="", after=None, before=None,
+                 page_size=DEFAULT_PAGE_SIZE):
+    """
+    Returns a SearchPage of matching soapids.
+
+    Simplified explanation:
+    - An empty search term lists the whole catalog.
+    - Otherwise results come from the FTS5 index, ranked with bm25
+      unless a sort option is chosen.
+    - Pages are found by keyset: `after` is the sort key of the last row
+      of the previous page, and the query resumes just past it through
+      the index, so deep pages cost the same as the first one.
+      `before` walks backwards the same way.
+    """
+    if search_term:
+        match_query = build_match_query(search_term)
+        if match_query is None:
+            return SearchPage([], None, None)
+        sort_option = sort_option or "relevance"
+    elif sort_option == "relevance":
+        # Without a search term there is nothing to rank by
+        sort_option = ""
+    columns, descending = SORT_KEYS.get(sort_option, SORT_KEYS[""])
+
+    backwards = before is not None
+    cursor = before if backwards else after
+    if cursor is not None and len(cursor) != len(columns):
+        cursor = None
+
+    # Walking back from `before` is the same query in the opposite order
+    reverse = descending != backwards
+    key = ", ".join(columns)
+    order = ", ".join(f"{column} {'DESC' if reverse else 'ASC'}"
+                      for column in columns)
+
+    conditions = []
+    params = []
+    if search_term:
+        conditions.append("SoapSearch MATCH ?")
+        params.append(match_query)
+    if cursor is not None:
+        placeholders = ", ".join("?" * len(columns))
+        conditions.append(
+            f"({key}) {'<' if reverse else '>'} ({placeholders})")
+        params.extend(cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if search_term:
+        sql = f"""SELECT Soap.soapid, {key}
+                  FROM SoapSearch
+                  JOIN Soap ON Soap.soapid = SoapSearch.rowid
+                  {where}
+                  ORDER BY {order} LIMIT ?"""
+    else:
+        sql = f"SELECT Soap.soapid, {key} FROM Soap \
+            {where} ORDER BY {order} LIMIT ?"
+    # One extra row tells us whether another page follows
+    params.append(page_size + 1)
+
+    rows = db.reader().execute(sql, params).fetchall()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return SearchPage([], None, None)
+
+    first = encode_cursor(rows[0][1:])
+    last = encode_cursor(rows[-1][1:])
+    if backwards:
+        previous_cursor, next_cursor = (first if more else None), last
+    else:
+        previous_cursor = first if cursor is not None else None
+        next_cursor = last if more else None
+    return SearchPage([row[0] for row in rows], previous_cursor, next_cursor)
+
+
+def init_app(app):
+    """
+    Registers the page size default.
+    """
+    app.config.setdefault("SEARCH_PAGE_SIZE", DEFAULT_PAGE_SIZE)
@@ -0,0 +1,176 @@
+# Responsive product images: a build step that writes resized, content-
+# hashed AVIF/WebP/JPEG variants of every Soap picture, and a template
+# helper that turns a picture path into an <img> with a matching srcset
+import hashlib
+import io
+import os
+
+import click
+from flask import current_app
+from markupsafe import Markup, escape
+
+import db
+import manifests
+
+# Widths generated for each picture (never wider than the original)
+DEFAULT_IMAGE_WIDTHS = [160, 320, 640, 1024]
+
+# Where variants and their manifest live, relative to the static folder
+BUILD_DIR = "images/build"
+manifest = manifests.Manifest(BUILD_DIR)
+
+# Output formats in order of preference, with their MIME types.
+# AVIF is skipped if the installed Pillow can't write it.
+FORMATS = [("avif", "image/avif"), ("webp", "image/webp"),
+           ("jpeg", "image/jpeg")]
+
+
+def _file_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    options = {"quality": quality}
+    if image_format == "jpeg":
+        image = image.convert("RGB")
+        options["optimize"] = True
+        options["progressive"] = True
+    image.save(buffer, image_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def build_picture(source_path, build_path, url_prefix, widths, formats,
+                  quality):
+    """
+    Writes every variant of one picture and returns its manifest entry.
+    File names include a hash of their contents, so a changed picture
+    always gets new URLs.
+    """
+    from PIL import Image
+
+    with open(source_path, "rb") as file:
+        source = file.read()
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    original = Image.open(io.BytesIO(source))
+    original.load()
+
+    sizes = sorted({min(width, original.width) for width in widths})
+    variants = {image_format: [] for image_format in formats}
+    for width in sizes:
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            data = _encode(resized, image_format, quality)
+            extension = "jpg" if image_format == "jpeg" else image_format
+            name = f"{stem}.{width}.{_file_hash(data)}.{extension}"
+            target = os.path.join(build_path, name)
+            if not os.path.exists(target):
+                with open(target, "wb") as file:
+                    file.write(data)
+            variants[image_format].append([width, f"{url_prefix}/{name}"])
+
+    return {
+        "source_hash": _file_hash(source),
+        "width": original.width,
+        "height": original.height,
+        "variants": variants,
+    }
+
+
+def responsive_image(picture, alt, sizes="100vw", css_class=None):
+    """
+    Template helper: returns a <picture> element offering every built
+    variant of `picture`, or a plain <img> if it hasn't been built.
+    """
+    attributes = f'alt="{escape(alt)}"'
+    if css_class:
+        attributes += f' class="{escape(css_class)}"'
+
+    entry = manifest.load(current_app).get(picture)
+    if not entry:
+        return Markup(f'<img src="{escape(picture)}" {attributes}>')
+
+    sources = []
+    fallback = None
+    for image_format, mime_type in FORMATS:
+        variants = entry["variants"].get(image_format)
+        if not variants:
+            continue
+        srcset = ", ".join(f"{escape(url)} {width}w"
+                           for width, url in variants)
+        if image_format == "jpeg":
+            fallback = (srcset, variants[-1][1])
+        else:
+            sources.append(f'<source type="{mime_type}" srcset="{srcset}" '
+                           f'sizes="{escape(sizes)}">')
+
+    srcset, src = fallback or (None, picture)
+    img = f'<img src="{escape(src)}" {attributes} loading="lazy" ' \
+        f'width="{entry["width"]}" height="{entry["height"]}"'
+    if srcset:
+        img += f' srcset="{srcset}" sizes="{escape(sizes)}"'
+    return Markup(f"<picture>{''.join(sources)}{img}></picture>")
+
+
+@click.group("images")
+def images_cli():
+    """Product image commands."""
+
+
+@images_cli.command("build")
+@click.option("--quality", default=80, show_default=True)
+def build_command(quality):
+    """Build resized, fingerprinted variants of every Soap picture."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise click.ClickException(
+            "Building images needs Pillow: pip install Pillow")
+
+    Image.init()
+    formats = [image_format for image_format, _ in FORMATS
+               if image_format.upper() in Image.SAVE]
+    widths = current_app.config["IMAGE_WIDTHS"]
+    static = current_app.static_folder
+    build_path = os.path.join(static, BUILD_DIR)
+    os.makedirs(build_path, exist_ok=True)
+    url_prefix = f"{current_app.static_url_path}/{BUILD_DIR}"
+
+    entries = dict(manifest.load(current_app))
+    pictures = [row[0] for row in db.reader().execute(
+        "SELECT DISTINCT picture FROM Soap WHERE picture IS NOT NULL")]
+
+    built = 0
+    for picture in pictures:
+        relative = picture.removeprefix(current_app.static_url_path + "/")
+        source_path = os.path.join(static, relative)
+        if not os.path.isfile(source_path):
+            click.echo(f"Missing picture: {picture}", err=True)
+            continue
+
+        # Skip pictures whose source hasn't changed since the last build
+        entry = entries.get(picture)
+        with open(source_path, "rb") as file:
+            if entry and entry["source_hash"] == _file_hash(file.read()):
+                continue
+
+        entries[picture] = build_picture(source_path, build_path,
+                                         url_prefix, widths, formats,
+                                         quality)
+        built += 1
+
+    manifest.write(current_app, entries)
+    click.echo(f"Built {built} of {len(pictures)} pictures "
+               f"as {', '.join(formats)}")
+
+
+def init_app(app):
+    """
+    Registers the widths default, the template helper, the cache headers
+    and the `flask images` commands.
+    """
+    app.config.setdefault("IMAGE_WIDTHS", DEFAULT_IMAGE_WIDTHS)
+    app.jinja_env.globals["responsive_image"] = responsive_image
+    manifests.register(app, manifest)
+    app.cli.add_command(images_cli)
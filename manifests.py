@@ -0,0 +1,128 @@
+# Build manifests for fingerprinted static files (product images and the
+# stylesheet and scripts): cheap re-reading, atomic writes, and the
+# long-lived cache headers the fingerprinted files are served with
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app, request
+
+# Fingerprinted files never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+MANIFEST = "manifest.json"
+
+
+class Manifest:
+    """
+    The manifest a build step writes into `build_dir` under the static
+    folder, mapping source files to what was built from them.
+
+    Simplified explanation:
+    - load() re-reads the file only when its modification time changes.
+    - version() changes with every build, for cache keys and ETags of
+      pages that link to the built files.
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self._mtime = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def path(self, app):
+        return os.path.join(app.static_folder, self.build_dir, MANIFEST)
+
+    def version(self, app):
+        """
+        Returns the manifest's modification time in nanoseconds, or 0 if
+        nothing has been built.
+        """
+        try:
+            return os.stat(self.path(app)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def built_at(self, app):
+        """
+        Returns when the manifest was last written, in whole seconds as
+        HTTP dates have, or None if nothing has been built.
+        """
+        version = self.version(app)
+        if not version:
+            return None
+        return datetime.fromtimestamp(version // 10 ** 9, timezone.utc)
+
+    def load(self, app):
+        """
+        Returns the manifest entries, or {} if nothing has been built.
+        """
+        mtime = self.version(app)
+        if not mtime:
+            return {}
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path(app)) as file:
+                        self._entries = json.load(file)
+                    self._mtime = mtime
+        return self._entries
+
+    def write(self, app, entries):
+        # Write to a temporary file first so readers never see half a
+        # manifest
+        path = self.path(app)
+        with open(path + ".tmp", "w") as file:
+            json.dump(entries, file, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+
+def is_built_file(manifest):
+    """
+    Returns True if the current request is for a fingerprinted file
+    under the manifest's build directory. The manifest itself is
+    rewritten by every build, so it isn't one.
+    """
+    filename = (request.view_args or {}).get("filename", "")
+    directory, _, name = filename.rpartition("/")
+    return request.endpoint == "static" and \
+        directory == manifest.build_dir and \
+        not name.startswith(MANIFEST)
+
+
+def add_cache_headers(response):
+    # Long-lived caching for fingerprinted files only
+    for manifest in current_app.extensions["soap_manifests"]:
+        if is_built_file(manifest):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def versions(app):
+    """
+    Returns the version of every registered manifest, for the cache
+    keys of pages and fragments that link to built files.
+    """
+    return tuple(manifest.version(app)
+                 for manifest in app.extensions["soap_manifests"])
+
+
+def last_built(app):
+    """
+    Returns when any registered manifest was last written, or None.
+    """
+    times = [manifest.built_at(app)
+             for manifest in app.extensions["soap_manifests"]]
+    return max(filter(None, times), default=None)
+
+
+def register(app, manifest):
+    """
+    Adds a manifest whose files get the long-lived cache headers. The
+    hook that adds them is registered with the first one.
+    """
+    registered = app.extensions.setdefault("soap_manifests", [])
+    if not registered:
+        app.after_request(add_cache_headers)
+    registered.append(manifest)
@@ -0,0 +1,160 @@
+# Per-request query metrics: every statement run through a pooled
+# connection is timed and counted, then reported in a Server-Timing
+# header and, when slow, in a structured slow-query log
+import json
+import logging
+import re
+import sqlite3
+import time
+
+from flask import g, current_app, has_request_context, request, \
+    before_render_template, template_rendered
+
+# Statements slower than this many milliseconds go to the slow-query log
+DEFAULT_SLOW_QUERY_MS = 100
+
+slow_query_log = logging.getLogger("soap.slow_queries")
+
+
+class QueryRecord:
+    """
+    One statement run during a request.
+    """
+
+    __slots__ = ("sql", "duration", "rows", "route")
+
+    def __init__(self, sql, route):
+        # Collapse whitespace so the same statement always has one template
+        self.sql = re.sub(r"\s+", " ", sql).strip()
+        self.duration = 0.0
+        self.rows = 0
+        self.route = route
+
+
+def _start_record(sql):
+    if not has_request_context():
+        return None
+    record = QueryRecord(sql, request.endpoint)
+    g.setdefault("queries", []).append(record)
+    return record
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times execution and fetching, and counts rows returned.
+    """
+
+    _record = None
+
+    def execute(self, sql, params=()):
+        self._record = _start_record(sql)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._add_time(start)
+
+    def executemany(self, sql, seq_of_params):
+        self._record = _start_record(sql)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._add_time(start)
+
+    def _add_time(self, start, rows=0):
+        if self._record is not None:
+            self._record.duration += time.perf_counter() - start
+            self._record.rows += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add_time(start, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add_time(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add_time(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add_time(start)
+            raise
+        self._add_time(start, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors (including the ones made by execute())
+    are InstrumentedCursors.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+def _start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _end_render(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        g.render_time = g.get("render_time", 0.0) + \
+            time.perf_counter() - started
+
+
+def add_server_timing(response):
+    """
+    Adds database time, query count and template render time to the
+    response, and logs any statements over the slow-query threshold.
+    """
+    queries = g.get("queries", [])
+    db_ms = sum(record.duration for record in queries) * 1000
+    render_ms = g.get("render_time", 0.0) * 1000
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={db_ms:.2f};desc="{len(queries)} queries", '
+        f"render;dur={render_ms:.2f}")
+
+    threshold = current_app.config["SLOW_QUERY_MS"]
+    for record in queries:
+        duration_ms = record.duration * 1000
+        if duration_ms >= threshold:
+            slow_query_log.warning(json.dumps({
+                "sql": record.sql,
+                "duration_ms": round(duration_ms, 2),
+                "rows": record.rows,
+                "route": record.route,
+                "path": request.path,
+            }))
+    return response
+
+
+def init_app(app):
+    """
+    Registers the threshold default and the request hooks.
+    """
+    app.config.setdefault("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)
+    app.after_request(add_server_timing)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
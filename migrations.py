@@ -0,0 +1,429 @@
+# Versioned schema migrations, applied in order by `flask db upgrade` (and
+# when a server starts) and recorded in the SchemaVersion table, plus a
+# query-plan check for full scans
+import ast
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+
+import click
+from flask import current_app
+
+import db
+
+# A numbered schema change; `sql` may hold several statements
+Migration = namedtuple("Migration", "version name sql")
+
+MIGRATIONS = [
+    # Open-cart lookups happen on nearly every logged-in request
+    Migration(1, "cart_user_status_index", """
+        CREATE INDEX IF NOT EXISTS Cart_user_status ON Cart (userid, status);
+    """),
+
+    # Each soap appears at most once per cart, which lets adds become a
+    # single upsert. Existing duplicates are merged before the index
+    Migration(2, "cart_item_unique_index", """
+        UPDATE CartItem
+        SET quantity = (SELECT SUM(dup.quantity) FROM CartItem AS dup
+                        WHERE dup.cartid = CartItem.cartid
+                        AND dup.soapid = CartItem.soapid)
+        WHERE rowid IN (SELECT MIN(rowid) FROM CartItem
+                        GROUP BY cartid, soapid HAVING COUNT(*) > 1);
+
+        DELETE FROM CartItem
+        WHERE rowid NOT IN (SELECT MIN(rowid) FROM CartItem
+                            GROUP BY cartid, soapid);
+
+        CREATE UNIQUE INDEX IF NOT EXISTS CartItem_cart_soap
+        ON CartItem (cartid, soapid);
+    """),
+
+    # Login and signup look users up by email
+    Migration(3, "user_email_unique_index", """
+        CREATE UNIQUE INDEX IF NOT EXISTS User_email ON User (email);
+    """),
+
+    # External-content FTS5 table over Soap, kept in sync by triggers so
+    # that any write to Soap (from the app or by hand) updates the index
+    Migration(4, "soap_search_index", """
+        CREATE VIRTUAL TABLE IF NOT EXISTS SoapSearch USING fts5(
+            name, description,
+            content='Soap', content_rowid='soapid',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS Soap_search_insert
+        AFTER INSERT ON Soap BEGIN
+            INSERT INTO SoapSearch (rowid, name, description)
+            VALUES (new.soapid, new.name, new.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Soap_search_delete
+        AFTER DELETE ON Soap BEGIN
+            INSERT INTO SoapSearch (SoapSearch, rowid, name, description)
+            VALUES ('delete', old.soapid, old.name, old.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Soap_search_update
+        AFTER UPDATE ON Soap BEGIN
+            INSERT INTO SoapSearch (SoapSearch, rowid, name, description)
+            VALUES ('delete', old.soapid, old.name, old.description);
+            INSERT INTO SoapSearch (rowid, name, description)
+            VALUES (new.soapid, new.name, new.description);
+        END;
+
+        INSERT INTO SoapSearch (SoapSearch) VALUES ('rebuild');
+    """),
+
+    # A single-row counter bumped by triggers on every write to Soap, so
+    # the catalog cache notices edits from any process without a restart
+    Migration(5, "catalog_version", """
+        CREATE TABLE IF NOT EXISTS CatalogVersion (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+
+        INSERT OR IGNORE INTO CatalogVersion (id, version) VALUES (1, 0);
+
+        CREATE TRIGGER IF NOT EXISTS Soap_version_insert
+        AFTER INSERT ON Soap BEGIN
+            UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Soap_version_update
+        AFTER UPDATE ON Soap BEGIN
+            UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Soap_version_delete
+        AFTER DELETE ON Soap BEGIN
+            UPDATE CatalogVersion SET version = version + 1 WHERE id = 1;
+        END;
+    """),
+
+    # Record when the catalog last changed, for Last-Modified headers
+    Migration(6, "catalog_version_updated_at", """
+        ALTER TABLE CatalogVersion ADD COLUMN updated_at DATETIME;
+
+        UPDATE CatalogVersion SET updated_at = datetime('now');
+
+        DROP TRIGGER IF EXISTS Soap_version_insert;
+        DROP TRIGGER IF EXISTS Soap_version_update;
+        DROP TRIGGER IF EXISTS Soap_version_delete;
+
+        CREATE TRIGGER Soap_version_insert AFTER INSERT ON Soap BEGIN
+            UPDATE CatalogVersion
+            SET version = version + 1, updated_at = datetime('now')
+            WHERE id = 1;
+        END;
+
+        CREATE TRIGGER Soap_version_update AFTER UPDATE ON Soap BEGIN
+            UPDATE CatalogVersion
+            SET version = version + 1, updated_at = datetime('now')
+            WHERE id = 1;
+        END;
+
+        CREATE TRIGGER Soap_version_delete AFTER DELETE ON Soap BEGIN
+            UPDATE CatalogVersion
+            SET version = version + 1, updated_at = datetime('now')
+            WHERE id = 1;
+        END;
+    """),
+
+    # Completed orders are snapshotted with the prices paid, so history
+    # pages never re-join the live Soap table. Orders completed before
+    # this migration are backfilled at today's prices, the best we have
+    Migration(7, "order_snapshots", """
+        CREATE TABLE IF NOT EXISTS OrderHeader (
+            orderid INTEGER PRIMARY KEY,
+            userid INTEGER NOT NULL REFERENCES User (userid),
+            order_date DATETIME,
+            completed_at DATETIME NOT NULL,
+            item_count INTEGER NOT NULL,
+            total REAL NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS OrderHeader_user
+        ON OrderHeader (userid, orderid);
+
+        CREATE TABLE IF NOT EXISTS OrderLine (
+            orderid INTEGER NOT NULL,
+            soapid INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            unit_price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (orderid, soapid)
+        ) WITHOUT ROWID;
+
+        INSERT OR IGNORE INTO OrderLine
+        (orderid, soapid, name, unit_price, quantity)
+        SELECT CartItem.cartid, Soap.soapid, Soap.name, Soap.price,
+               CartItem.quantity
+        FROM Cart
+        JOIN CartItem ON CartItem.cartid = Cart.cartid
+        JOIN Soap ON Soap.soapid = CartItem.soapid
+        WHERE Cart.status = 'completed' AND CartItem.quantity > 0;
+
+        INSERT OR IGNORE INTO OrderHeader
+        (orderid, userid, order_date, completed_at, item_count, total)
+        SELECT Cart.cartid, Cart.userid, Cart.order_date, Cart.order_date,
+               COALESCE(SUM(OrderLine.quantity), 0),
+               ROUND(COALESCE(SUM(OrderLine.quantity
+                                  * OrderLine.unit_price), 0), 2)
+        FROM Cart
+        LEFT JOIN OrderLine ON OrderLine.orderid = Cart.cartid
+        WHERE Cart.status = 'completed'
+        GROUP BY Cart.cartid;
+    """),
+
+    # Search pages resume from the last row's sort key, which needs an
+    # index matching each sort order
+    Migration(8, "soap_sort_indexes", """
+        CREATE INDEX IF NOT EXISTS Soap_price ON Soap (price, soapid);
+        CREATE INDEX IF NOT EXISTS Soap_name ON Soap (name, soapid);
+    """),
+
+    # Accounts waiting for their carts to be purged after deletion
+    Migration(9, "deleted_users", """
+        CREATE TABLE IF NOT EXISTS DeletedUser (
+            userid INTEGER PRIMARY KEY,
+            deleted_at DATETIME NOT NULL
+        );
+    """),
+
+    # Per-day, per-soap sales totals kept up to date as orders complete,
+    # plus the staging table `flask sales rebuild` fills before swapping
+    Migration(10, "sales_rollups", """
+        CREATE TABLE IF NOT EXISTS SalesDaily (
+            day TEXT NOT NULL,
+            soapid INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, soapid)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS SalesDailyRebuild (
+            day TEXT NOT NULL,
+            soapid INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, soapid)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS OrderHeader_completed
+        ON OrderHeader (completed_at);
+
+        INSERT OR IGNORE INTO SalesDaily (day, soapid, quantity, revenue)
+        SELECT date(OrderHeader.completed_at), OrderLine.soapid,
+               SUM(OrderLine.quantity),
+               ROUND(SUM(OrderLine.quantity * OrderLine.unit_price), 2)
+        FROM OrderHeader
+        JOIN OrderLine ON OrderLine.orderid = OrderHeader.orderid
+        GROUP BY 1, 2;
+    """),
+
+    # Statements that finish an interrupted bulk load, such as the Soap
+    # indexes and triggers a catalog import drops while it runs
+    Migration(11, "deferred_statements", """
+        CREATE TABLE IF NOT EXISTS DeferredStatement (
+            seq INTEGER PRIMARY KEY,
+            sql TEXT NOT NULL
+        );
+    """),
+]
+
+# Tables expected to grow with traffic; a full scan of these is a bug
+LARGE_TABLES = {"User", "Cart", "CartItem", "CustomerServiceRequest",
+                "OrderHeader", "OrderLine", "SalesDaily"}
+
+# Modules whose SQL is checked by `flask db check-plans`
+CHECKED_MODULES = ["routes.py", "accounts.py", "cart.py", "catalog.py",
+                   "fulltext.py", "orders.py", "sales.py", "users.py"]
+
+
+def split_statements(sql):
+    """
+    Splits a script into single statements, keeping trigger bodies
+    (which contain their own semicolons) in one piece.
+    """
+    statement = ""
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+    if statement.strip():
+        yield statement.strip()
+
+
+def applied_versions(connection):
+    return {row[0] for row in
+            connection.execute("SELECT version FROM SchemaVersion")}
+
+
+def migrate(connection):
+    """
+    Applies every migration that hasn't been applied yet.
+
+    Simplified explanation:
+    - Each migration runs in its own transaction together with the
+      SchemaVersion row that records it, so it is all-or-nothing.
+    - The applied versions are re-read inside the transaction, so two
+      processes starting at once don't apply the same migration twice.
+    Returns the list of migrations that were applied.
+    """
+    connection.execute("""CREATE TABLE IF NOT EXISTS SchemaVersion (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)""")
+    connection.commit()
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version in applied_versions(connection):
+            continue
+        with db.transaction(connection):
+            if migration.version in applied_versions(connection):
+                continue
+            for statement in split_statements(migration.sql):
+                connection.execute(statement)
+            connection.execute(
+                "INSERT INTO SchemaVersion (version, name) VALUES (?, ?)",
+                (migration.version, migration.name))
+        applied.append(migration)
+    return applied
+
+
+def defer_statements(connection, now, later):
+    """
+    Runs the `now` statements and records the `later` ones in a single
+    transaction. run_deferred() runs what was recorded; until it does,
+    the next upgrade() will, so a bulk load that is killed halfway
+    can't leave its schema changes behind.
+    """
+    with db.transaction(connection):
+        for sql in now:
+            connection.execute(sql)
+        connection.executemany(
+            "INSERT INTO DeferredStatement (sql) VALUES (?)",
+            [(sql,) for sql in later])
+
+
+def run_deferred(connection):
+    """
+    Runs and forgets the recorded statements, in one transaction.
+    Returns how many there were.
+    """
+    with db.transaction(connection):
+        statements = connection.execute(
+            "SELECT sql FROM DeferredStatement ORDER BY seq").fetchall()
+        for sql, in statements:
+            connection.execute(sql)
+        connection.execute("DELETE FROM DeferredStatement")
+    return len(statements)
+
+
+def upgrade(app):
+    """
+    Applies any pending migrations to the app's database, and finishes
+    any bulk load that was interrupted. Returns the list of migrations
+    that were applied.
+    """
+    connection = db.open_connection(app)
+    try:
+        applied = migrate(connection)
+        finished = run_deferred(connection)
+    finally:
+        connection.close()
+    if finished:
+        app.logger.warning(f"Ran {finished} statements left by an "
+                           f"interrupted bulk load")
+    return applied
+
+
+def find_queries(path):
+    """
+    Yields (line number, SQL) for every plain string literal in a module
+    that looks like a query. f-strings are skipped since their SQL
+    isn't known until runtime.
+    """
+    with open(path) as file:
+        tree = ast.parse(file.read(), path)
+    # The literal pieces of an f-string aren't queries on their own
+    f_string_parts = {id(value) for node in ast.walk(tree)
+                      if isinstance(node, ast.JoinedStr)
+                      for value in node.values}
+    for node in ast.walk(tree):
+        if id(node) in f_string_parts:
+            continue
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            sql = " ".join(node.value.split())
+            if sql.split(" ", 1)[0].upper() in (
+                    "SELECT", "INSERT", "UPDATE", "DELETE"):
+                yield node.lineno, sql
+
+
+def full_scans(connection, sql):
+    """
+    Returns the plan steps for `sql` that scan a whole large table.
+    """
+    params = (None,) * sql.count("?")
+    plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [row[3] for row in plan
+            if row[3].startswith("SCAN ")
+            and row[3].split()[1] in LARGE_TABLES]
+
+
+@click.group("db")
+def db_cli():
+    """Database schema commands."""
+
+
+@db_cli.command("upgrade")
+def upgrade_command():
+    """Apply any pending schema migrations."""
+    applied = upgrade(current_app)
+    for migration in applied:
+        click.echo(f"Applied {migration.version:03d} {migration.name}")
+    if not applied:
+        click.echo("Schema is up to date")
+
+
+@db_cli.command("check-plans")
+def check_plans_command():
+    """Fail if any query in the app does a full scan of a large table."""
+    connection = db.reader()
+    failures = 0
+    for module in CHECKED_MODULES:
+        path = os.path.join(os.path.dirname(__file__), module)
+        for lineno, sql in find_queries(path):
+            for step in full_scans(connection, sql):
+                failures += 1
+                click.echo(f"{module}:{lineno}: {step}\n    {sql}")
+    if failures:
+        click.echo(f"{failures} full table scan(s) found")
+        sys.exit(1)
+    click.echo("No full scans of large tables")
+
+
+@db_cli.command("enable-incremental-vacuum")
+def enable_incremental_vacuum_command():
+    """Switch to incremental auto-vacuum (runs one full VACUUM)."""
+    connection = db.open_connection(current_app)
+    try:
+        # Changing auto_vacuum on an existing database only takes
+        # effect after a VACUUM, which rewrites the whole file
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    click.echo("Incremental vacuum enabled")
+
+
+def init_app(app):
+    """
+    Registers the `flask db` commands. Importing the app never touches
+    the schema; servers call upgrade() as they start.
+    """
+    app.cli.add_command(db_cli)
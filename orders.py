@@ -0,0 +1,92 @@
+# Order snapshots: completing a cart writes an OrderHeader with its totals
+# and one OrderLine per soap at the price paid, and history pages are
+# served from those tables alone. Completion also feeds the sales rollups
+import db
+import sales
+
+# Default number of orders per page of order history
+DEFAULT_ORDER_PAGE_SIZE = 20
+
+
+def complete(userid, cartid):
+    """
+    Turns the user's open cart into an order, all in one transaction.
+    Returns the number of order lines written: None if the cart isn't
+    the user's open cart, 0 if it is empty (nothing is changed).
+    """
+    with db.write_transaction() as connection:
+        sql = """SELECT order_date FROM Cart
+                 WHERE cartid = ? AND userid = ? AND status = 'open'"""
+        cart = connection.execute(sql, (cartid, userid)).fetchone()
+        if not cart:
+            return None
+
+        # Snapshot each line with the name and price at purchase
+        sql = """INSERT INTO OrderLine
+                 (orderid, soapid, name, unit_price, quantity)
+                 SELECT CartItem.cartid, Soap.soapid, Soap.name, Soap.price,
+                        CartItem.quantity
+                 FROM CartItem
+                 JOIN Soap ON Soap.soapid = CartItem.soapid
+                 WHERE CartItem.cartid = ? AND CartItem.quantity > 0"""
+        lines = connection.execute(sql, (cartid,)).rowcount
+        if not lines:
+            return 0
+
+        sql = """INSERT INTO OrderHeader
+                 (orderid, userid, order_date, completed_at, item_count, total)
+                 SELECT ?, ?, ?, datetime('now'), SUM(quantity),
+                        ROUND(SUM(quantity * unit_price), 2)
+                 FROM OrderLine WHERE orderid = ?"""
+        connection.execute(sql, (cartid, userid, cart[0], cartid))
+
+        sql = "UPDATE Cart SET status = 'completed' WHERE cartid = ?"
+        connection.execute(sql, (cartid,))
+
+        # The sales rollups commit (or roll back) with the order
+        sales.record_order(connection, cartid)
+        return lines
+
+
+def history(userid, before=None, page_size=DEFAULT_ORDER_PAGE_SIZE):
+    """
+    Returns one page of the user's orders, newest first, and the cursor
+    for the next page (None on the last page).
+
+    Simplified explanation:
+    - `before` is the last orderid on the previous page; the next page
+      continues from there using the (userid, orderid) index, so deep
+      pages cost the same as the first one.
+    """
+    sql = """SELECT orderid, order_date, item_count, total
+             FROM OrderHeader
+             WHERE userid = ? AND orderid < ?
+             ORDER BY orderid DESC LIMIT ?"""
+    cursor = before if before is not None else 2 ** 63 - 1
+    rows = db.reader().execute(
+        sql, (userid, cursor, page_size + 1)).fetchall()
+    next_before = rows[page_size - 1][0] if len(rows) > page_size else None
+    return rows[:page_size], next_before
+
+
+def get_order(userid, orderid):
+    """
+    Returns the user's order header and its lines, or (None, []).
+    """
+    connection = db.reader()
+    sql = """SELECT orderid, order_date, item_count, total
+             FROM OrderHeader WHERE orderid = ? AND userid = ?"""
+    header = connection.execute(sql, (orderid, userid)).fetchone()
+    if not header:
+        return None, []
+
+    sql = """SELECT soapid, name, unit_price, quantity
+             FROM OrderLine WHERE orderid = ? ORDER BY soapid"""
+    return header, connection.execute(sql, (orderid,)).fetchall()
+
+
+def init_app(app):
+    """
+    Registers the page size default.
+    """
+    app.config.setdefault("ORDER_PAGE_SIZE", DEFAULT_ORDER_PAGE_SIZE)
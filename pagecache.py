@@ -0,0 +1,200 @@
+# HTTP caching for pages that look the same to every anonymous visitor:
+# ETag/Last-Modified validators, 304 answers to conditional GETs, and a
+# bounded in-memory LRU cache of rendered pages
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, request, session
+
+import catalog
+import compression
+import manifests
+
+# Default number of rendered pages kept in memory
+DEFAULT_PAGE_CACHE_SIZE = 256
+
+# Browsers and proxies may store the page but must revalidate it first
+CACHE_CONTROL = "public, no-cache"
+
+
+class PageCache:
+    """
+    Least-recently-used cache of rendered pages, keyed by route and
+    query string. Each entry remembers the ETag it was rendered for, its
+    content type and the page compressed with each encoding asked for
+    so far, so a hit isn't compressed again.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.catalog_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, key, etag, body, mimetype="text/html"):
+        with self._lock:
+            self._entries[key] = (etag, body, mimetype, {})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear_if_stale(self, version):
+        # Drops every page at once when the Soap table has changed
+        with self._lock:
+            if version != self.catalog_version:
+                self._entries.clear()
+                self.catalog_version = version
+
+
+_templates_mtime = None
+
+
+def templates_mtime(app):
+    """
+    Returns the newest template modification time. It is only worked
+    out once per process unless the app is in debug mode.
+    """
+    global _templates_mtime
+    if _templates_mtime is None or app.debug:
+        folder = os.path.join(app.root_path, app.template_folder)
+        newest = max(os.path.getmtime(os.path.join(folder, name))
+                     for name in os.listdir(folder))
+        _templates_mtime = datetime.fromtimestamp(
+            int(newest), timezone.utc)
+    return _templates_mtime
+
+
+def _validators(uses_catalog):
+    """
+    Returns the ETag and Last-Modified time for the current request.
+    """
+    last_modified = templates_mtime(current_app)
+    parts = [request.full_path, last_modified.isoformat()]
+    # Pages link to fingerprinted assets and product images, so each
+    # build gives them new validators
+    parts.extend(str(version) for version in manifests.versions(current_app))
+    built = manifests.last_built(current_app)
+    if built and built > last_modified:
+        last_modified = built
+    if uses_catalog:
+        version = catalog.current_version()
+        current_app.extensions["soap_page_cache"].clear_if_stale(version)
+        parts.append(str(version))
+        changed = catalog.updated_at()
+        if changed and changed > last_modified:
+            last_modified = changed
+    etag = hashlib.sha1(":".join(parts).encode()).hexdigest()[:20]
+    return etag, last_modified
+
+
+def _add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.vary.add("Cookie")
+    return response
+
+
+def _fill(cache, key, etag, mimetype, chunks):
+    # Passes a streamed page through to the client, and caches it once
+    # the last chunk has gone out
+    body = []
+    for chunk in chunks:
+        body.append(chunk.encode() if isinstance(chunk, str) else chunk)
+        yield chunk
+    cache.put(key, etag, b"".join(body), mimetype)
+
+
+def _cached_response(body, mimetype, encoded):
+    # Serves a cached page, compressing it at most once per encoding.
+    # Two requests may both compress it; either result can be kept
+    encoding = compression.choose_encoding(mimetype, len(body))
+    if encoding is None:
+        return current_app.response_class(body, mimetype=mimetype)
+    data = encoded.get(encoding)
+    if data is None:
+        data = encoded[encoding] = compression.compress(body, encoding)
+    response = current_app.response_class(data, mimetype=mimetype)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def cached_page(uses_catalog=False):
+    """
+    Decorator for pages that are the same for every anonymous visitor.
+
+    Simplified explanation:
+    - Requests with a session (logged in, or with flash messages waiting)
+      are passed straight to the view.
+    - Otherwise a matching If-None-Match/If-Modified-Since gets a 304,
+      and a page rendered earlier for the same ETag is reused.
+    - Catalog pages change their ETag whenever the Soap table changes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or session:
+                return view(*args, **kwargs)
+
+            cache = current_app.extensions["soap_page_cache"]
+            etag, last_modified = _validators(uses_catalog)
+            key = (request.endpoint, request.query_string)
+
+            # The client already has this version; skip rendering entirely.
+            # Compressed pages carry the weak form of the same ETag
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                return _add_validators(response, etag, last_modified)
+
+            entry = cache.get(key, etag)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                # Only successful, session-free pages are shared
+                if response.status_code != 200 or session:
+                    return response
+                if response.is_streamed:
+                    response.response = _fill(cache, key, etag,
+                                              response.mimetype,
+                                              response.response)
+                else:
+                    cache.put(key, etag, response.get_data(),
+                              response.mimetype)
+            else:
+                response = _cached_response(*entry)
+
+            _add_validators(response, etag, last_modified)
+            if "Content-Encoding" in response.headers:
+                compression.weaken_etag(response)
+            # make_conditional would buffer a streamed body to work out
+            # its length; If-None-Match was already answered above
+            if response.is_streamed:
+                return response
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """
+    Registers the cache size default and creates the page cache.
+    """
+    app.config.setdefault("PAGE_CACHE_SIZE", DEFAULT_PAGE_CACHE_SIZE)
+    app.extensions["soap_page_cache"] = PageCache(
+        app.config["PAGE_CACHE_SIZE"])
@@ -0,0 +1,169 @@
+# Password hashing service: hashing and checking run in a small process
+# pool instead of on the request thread, with a cap on waiting work
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, \
+    TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+
+# werkzeug hash method, e.g. "scrypt", "scrypt:65536:8:1" or
+# "pbkdf2:sha256:1000000"; changing it rehashes passwords on next login
+DEFAULT_HASH_METHOD = "scrypt"
+
+# Seconds to wait for a hash before giving up
+DEFAULT_HASH_TIMEOUT = 10
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many hashes are already waiting, so the request can
+    be turned away straight away instead of queueing. Also raised when a
+    hash times out or its worker dies.
+    """
+
+
+def method_prefix(method):
+    """
+    Expands a hash method to the full prefix werkzeug stores in front of
+    the salt, so "scrypt" becomes "scrypt:32768:8:1".
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        return ":".join(["scrypt"] + (args or ["32768", "8", "1"]))
+    if name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+        return ":".join(["pbkdf2"] + args + defaults[len(args):])
+    return method
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(stored_hash, password, method):
+    # Runs in a worker: checks the password and, if it was stored with
+    # an older method, hashes it again with the current one
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split("$", 1)[0] != method_prefix(method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class HashingService:
+    """
+    Runs password hashing in a process pool.
+
+    Simplified explanation:
+    - At most `queue_limit` hashes may be running or waiting at once;
+      beyond that HashingBusy is raised instead of queueing. A hash that
+      times out keeps its slot until the worker has finished it.
+    - A pool whose worker died (killed for memory, say) is replaced, so
+      only the hashes that were in it fail.
+    - Workers are spawned rather than forked: forking copies whatever
+      locks the server's other threads held at that moment.
+    - With zero workers, hashing runs inline on the request thread.
+    """
+
+    def __init__(self, workers, queue_limit, method, timeout):
+        self.workers = workers
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        # The pool is started on first use, after any worker fork
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _replace_broken(self, pool):
+        # Several requests may notice the same broken pool; only the
+        # first replaces it
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, future):
+        self._slots.release()
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        if not self.workers:
+            try:
+                return function(*args)
+            finally:
+                self._slots.release()
+
+        pool = self._executor()
+        try:
+            future = pool.submit(function, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._replace_broken(pool)
+            raise HashingBusy()
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except (FutureTimeout, TimeoutError):
+            # Drops the hash if it hasn't started yet. Before Python 3.11
+            # futures raise their own TimeoutError, not the builtin one
+            future.cancel()
+            raise HashingBusy()
+        except BrokenProcessPool:
+            self._replace_broken(pool)
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """
+        Returns (matches, new_hash). new_hash is set when the password
+        matched but was stored with an outdated method or cost.
+        """
+        return self._run(_verify, stored_hash, password, self.method)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def hash_password(password):
+    return current_app.extensions["soap_hashing"].hash(password)
+
+
+def verify_password(stored_hash, password):
+    return current_app.extensions["soap_hashing"].verify(stored_hash,
+                                                         password)
+
+
+def init_app(app):
+    """
+    Registers the hashing config defaults and creates the service.
+    """
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    app.config.setdefault("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+    app.config.setdefault("HASH_WORKERS", workers)
+    app.config.setdefault("HASH_QUEUE_LIMIT", workers * 4)
+    app.config.setdefault("HASH_TIMEOUT", DEFAULT_HASH_TIMEOUT)
+    app.extensions["soap_hashing"] = HashingService(
+        app.config["HASH_WORKERS"], app.config["HASH_QUEUE_LIMIT"],
+        app.config["PASSWORD_HASH_METHOD"], app.config["HASH_TIMEOUT"])
@@ -1,36 +1,82 @@
 # Import necessary modules: Flask properties for web app,
 # Sqlite3 for database interactions, and secrets for secure token generation
 from flask import Flask, render_template, request, redirect, \
-    url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
+    url_for, flash, session, stream_template, get_flashed_messages
+import os
 import sqlite3
 import secrets
+from datetime import datetime, timezone
+
+import accounts
+import admission
+import api
+import assets
+import batchwriter
+import cart
+import catalog
+import catalogsync
+import compression
+import db
+import fragments
+import fulltext
+import images
+import metrics
+import migrations
+import orders
+import pagecache
+import passwords
+import sales
+import suggest
+import users
 
 app = Flask(__name__)
 
-
-# Generates a 24-hex secret key to secure session data
-app.secret_key = secrets.token_hex(24)
-
-
-def execute_query(sql, params=(), fetchone=False,
-                  fetchall=False, commit=False):
+# Database path and connection pool size, overridable from the environment
+app.config.from_prefixed_env("SOAP")
+db.init_app(app)
+admission.init_app(app)
+metrics.init_app(app)
+migrations.init_app(app)
+fulltext.init_app(app)
+images.init_app(app)
+fragments.init_app(app)
+pagecache.init_app(app)
+passwords.init_app(app)
+batchwriter.init_app(app)
+orders.init_app(app)
+catalogsync.init_app(app)
+cart.init_app(app)
+accounts.init_app(app)
+sales.init_app(app)
+api.init_app(app)
+suggest.init_app(app)
+assets.init_app(app)
+compression.init_app(app)
+
+
+# Sessions are signed with SOAP_SECRET_KEY. Without one, a 24-hex key is
+# generated at startup, so sessions end with the process; that only
+# suits the development server (serve.py refuses to start without it)
+if not app.secret_key:
+    app.secret_key = secrets.token_hex(24)
+
+
+def execute_query(sql, params=(), fetchone=False, fetchall=False):
     """
-    Executes a query on the SQLite database.
+    Runs a read-only query on the SQLite database.
 
     Simplified explanation:
     - Executes SQL with optional parameters.
     - Optionally fetches one or all results.
-    - Optionally commits transactions (e.g., INSERT, UPDATE, DELETE).
+    - Uses the request's pooled read-only connection, so it never waits
+      on writers; anything that changes data goes through execute_write.
     """
-    connection = sqlite3.connect("Soap.db")
+    connection = db.reader()
     cursor = connection.cursor()
     result = None
 
     try:
         cursor.execute(sql, params)
-        if commit:
-            connection.commit()
 
         if fetchone:
             result = cursor.fetchone()
@@ -42,38 +88,58 @@ def execute_query(sql, params=(), fetchone=False,
         raise
 
     finally:
-        connection.close()
+        cursor.close()
 
     return result
 
 
+def execute_write(sql, params=()):
+    """
+    Runs one INSERT, UPDATE or DELETE as its own transaction on the
+    process's writer connection, and returns the number of rows changed.
+    """
+    try:
+        with db.write_transaction() as connection:
+            return connection.execute(sql, params).rowcount
+    except sqlite3.Error as e:
+        app.logger.error(f"Database error: {e}")
+        raise
+
+
 # Inject the user's first name into all templates if logged in
 @app.context_processor
 def inject_user_firstname():
-    user_firstname = None
-    userid = session.get("userid")
-    if userid:
-        sql = "SELECT fname FROM User WHERE userid = ?"
-        user = execute_query(sql, (userid,), fetchone=True)
-        if user:
-            user_firstname = user[0]
-    return dict(user_firstname=user_firstname)
+    return dict(user_firstname=users.display_name())
+
+
+# Busy page shown when too many password hashes, buffered writes or
+# write requests are already waiting
+@app.errorhandler(passwords.HashingBusy)
+@app.errorhandler(batchwriter.WriterBusy)
+@app.errorhandler(admission.Overloaded)
+def server_busy(error):
+    if request.blueprint == "api":
+        return {"error": "busy"}, 503, {"Retry-After": "2"}
+    return render_template("503.html"), 503, {"Retry-After": "2"}
+
+
+# Shown when one client, or everyone together, is sending a kind of
+# write request faster than its limit
+@app.errorhandler(admission.RateLimited)
+def too_many_requests(error):
+    headers = {"Retry-After": admission.retry_after(error)}
+    if request.blueprint == "api":
+        return {"error": "too many requests"}, 429, headers
+    return render_template("429.html"), 429, headers
 
 
 # Home page route displaying featured items and a gallery of products
 @app.route("/")
+@pagecache.cached_page(uses_catalog=True)
 def home():
-    # SQL query to fetch featured items
-    featured_sql = "SELECT name, picture, description\
-        FROM Soap WHERE is_featured=1"
-    featured_items = execute_query(featured_sql, fetchall=True)
-
-    # SQL query to fetch all items for the gallery
-    sql = "SELECT name, picture FROM Soap"
-    items = execute_query(sql, fetchall=True)
-
-    return render_template("home.html", featured_items=featured_items,
-                           items=items)
+    # Featured items and the gallery come from the cached catalog
+    return render_template("home.html", featured_items=catalog.featured(),
+                           items=catalog.gallery())
 
 
 # Login route
@@ -93,9 +159,15 @@ def login():
             flash('Something went wrong, please try again soon', 'error')
             return redirect(url_for('login'))
 
-        # Verify password and log in user
-        if user and check_password_hash(user[11], password):
-            session["userid"] = user[0]
+        # Verify password (off the request thread) and log in user
+        matches, new_hash = passwords.verify_password(user[11], password) \
+            if user else (False, None)
+        if matches:
+            if new_hash:
+                # Stored with an outdated hash cost, so upgrade it now
+                sql = "UPDATE User SET password = ? WHERE userid = ?"
+                execute_write(sql, (new_hash, user[0]))
+            users.remember_user(user)
             return redirect(url_for("home"))
         else:
             flash("Incorrect email or password", 'error')
@@ -141,9 +213,14 @@ def signup():
         # Insert new user into the database with hashed password
         sql = "INSERT INTO User (fname, lname, email, password)\
                 VALUES (?, ?, ?, ?)"
-        execute_query(sql, (fname, lname, email,
-                            generate_password_hash(password)),
-                      commit=True)
+        try:
+            execute_write(sql, (fname, lname, email,
+                                passwords.hash_password(password)))
+        except sqlite3.IntegrityError:
+            # Someone else signed up with this email in the meantime
+            flash("Email unavailable.\
+                  Please choose another email or login.", 'error')
+            return redirect(url_for('signup'))
         flash("Thanks for signing up! Please log in.", 'success')
         return redirect(url_for("login"))
 
@@ -167,9 +244,8 @@ def userinfo():
         flash("Please login to access your information", 'message')
         return render_template("login.html")
 
-    # SQL query to fetch the logged-in user's information
-    sql = "SELECT * FROM User WHERE userid = ?"
-    user = execute_query(sql, (userid,), fetchone=True)
+    # Fetch the logged-in user's information (once per request)
+    user = users.current_user()
 
     if not user:
         return render_template('404.html'), 404
@@ -187,13 +263,30 @@ def customer_service():
         subject = request.form.get("subject")
         message = request.form.get("message")
 
-        # Insert contact form data into the database
-        sql = """
-        INSERT INTO CustomerServiceRequest
-        (name, email, subject, message)
-        VALUES (?, ?, ?, ?)
-        """
-        execute_query(sql, (name, email, subject, message), commit=True)
+        # Hand the request to the batch writer, keeping the time it was
+        # submitted rather than the time its batch is written
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        write = batchwriter.customer_service_writer().submit(
+            (name, email, subject, message, created_at),
+            app.config["CUSTOMER_SERVICE_ENQUEUE_TIMEOUT"])
+
+        if app.config["CUSTOMER_SERVICE_WAIT_FOR_COMMIT"]:
+            # Wait for the batch's commit (shared with other requests)
+            try:
+                committed = write.wait(
+                    app.config["CUSTOMER_SERVICE_COMMIT_TIMEOUT"])
+            except sqlite3.Error as e:
+                app.logger.error(f"Error saving customer request: {e}")
+                flash("Sorry, we couldn't submit your request. \
+                      Please try again.", "error")
+                return redirect(url_for("customer_service"))
+            if not committed:
+                # Still queued; it may yet be saved, so don't say it failed
+                app.logger.warning("Customer request not committed in time")
+                flash("We couldn't confirm your request was received. "
+                      "Please wait a few minutes before sending it again.",
+                      "error")
+                return redirect(url_for("customer_service"))
 
         flash("Your request has been submitted successfully.", "success")
         return redirect(url_for("customer_service"))
@@ -210,32 +303,9 @@ def view_current_cart():
         flash("Please log in to view your cart", 'message')
         return redirect(url_for("login"))
 
-    # SQL query to check if the user has an open cart
-    sql = "SELECT cartid FROM Cart WHERE userid = ? AND status = 'open'"
-    cartid = execute_query(sql, (userid,), fetchone=True)
-
-    if cartid:
-        cartid = cartid[0]
-    else:
-        # Create a new cart if none exists
-        sql = """INSERT INTO Cart (userid, order_date, status)
-                VALUES (?, datetime('now'), 'open')"""
-        execute_query(sql, (userid,), commit=True)
-        sql = "SELECT cartid FROM Cart WHERE userid = ? AND status = 'open'"
-        cartid = execute_query(sql, (userid,), fetchone=True)
-        cartid = cartid[0]
-
-    # SQL query to gather items in the cart
-    sql = """
-        SELECT Soap.soapid AS soapid,
-               Soap.name AS soap_name,
-               Soap.price AS unit_price,
-               CartItem.quantity AS soap_quantity
-        FROM CartItem
-        JOIN Soap ON Soap.soapid = CartItem.soapid
-        WHERE CartItem.cartid = ?
-        """
-    cart_items = execute_query(sql, (cartid,), fetchall=True)
+    # An empty cart is only virtual: cartid is None until the first item
+    # is added, so looking at the cart never writes anything
+    cartid, cart_items = cart.contents(userid)
 
     # Calculate total price for all items in the cart
     total_price = sum(item[2] * item[3] for item in cart_items)
@@ -279,45 +349,16 @@ def add_to_cart():
         flash("No item specified to add to cart", 'error')
         return redirect(redirect_url or url_for('search'))
 
-    try:
-        # Check for an open cart for the user
-        sql = "SELECT cartid FROM Cart WHERE userid = ? AND status = 'open'"
-        cart = execute_query(sql, (userid,), True)
-
-        if not cart:
-            # Create a new cart if no open cart exists
-            sql = """INSERT INTO Cart (userid, order_date, status)
-                     VALUES (?, datetime('now'), 'open')"""
-            execute_query(sql, (userid,), commit=True)
-            # Fetch the newly created cart's ID
-            sql = "SELECT cartid FROM Cart \
-                WHERE userid = ? AND status = 'open'"
-            cart = execute_query(sql, (userid,), True)
-
-        cartid = cart[0]
-
-        # Check if the item is already in the cart
-        sql = "SELECT quantity FROM CartItem WHERE cartid = ? AND soapid = ?"
-        existing_item = execute_query(sql, (cartid, soapid), True)
-
-        # Fetch the soap name to show in the flash message
-        sql = "SELECT name FROM Soap WHERE soapid = ?"
-        soap_name_result = execute_query(sql, (soapid,), True)
-        soap_name = soap_name_result[0] if soap_name_result else "Unknown item"
-
-        if existing_item:
-            # If item exists, increase the quantity
-            new_quantity = int(existing_item[0]) + 1
-            sql = "UPDATE CartItem SET quantity = ? \
-                WHERE cartid = ? AND soapid = ?"
-            execute_query(sql, (new_quantity, cartid, soapid), commit=True)
-        else:
-            # If item does not exist, insert it into the cart
-            sql = "INSERT INTO CartItem (cartid, soapid, quantity) \
-                VALUES (?, ?, 1)"
-            execute_query(sql, (cartid, soapid), commit=True)
+    # Fetch the soap to show its name in the flash message
+    soap = catalog.lookup(soapid)
+    if not soap:
+        flash("That item is no longer available", 'error')
+        return redirect(redirect_url or url_for('search'))
 
-        flash(f'{soap_name} added to cart', 'success')
+    try:
+        # Add the item (and the cart, if needed) in one transaction
+        cart.add_item(userid, soap.soapid)
+        flash(f'{soap.name} added to cart', 'success')
 
     except Exception as e:
         # Log the error if an issue occurs and inform the user
@@ -338,29 +379,19 @@ def complete_order(cartid):
         flash("Please log in to complete your order.", 'message')
         return redirect(url_for("login"))
 
-    # Verify the cart belongs to the user and is open
-    sql = """SELECT * FROM Cart WHERE cartid = ? \
-        AND userid = ? AND status = 'open'"""
-    cart = execute_query(sql, (cartid, userid), True)
+    # Snapshot the cart into an order in one transaction
+    lines = orders.complete(userid, cartid)
 
-    if not cart:
+    if lines is None:
         # If the cart doesn't exist or isn't open, show error page
         return render_template('404.html'), 404
 
-    # Check if the cart has any items
-    sql = "SELECT COUNT(*) FROM CartItem WHERE cartid = ?"
-    item_count = execute_query(sql, (cartid,), True)[0]
-
-    if item_count == 0:
+    if lines == 0:
         # Prevent order completion if cart is empty
         flash("Your cart is empty. \
               You cannot complete an order without items.", 'error')
         return redirect(url_for("view_current_cart"))
 
-    # Update the cart's status to 'completed'
-    sql = "UPDATE Cart SET status = 'completed' WHERE cartid = ?"
-    execute_query(sql, (cartid,), commit=True)
-
     flash("Order completed! \
           To view the contents of this order, \
           please explore your previous carts", 'success')
@@ -376,26 +407,15 @@ def view_previous_order(cartid):
         flash("Please log in to view your previous order", 'message')
         return redirect(url_for("login"))
 
-    # Check if the cart is completed and belongs to the user
-    sql = "SELECT status FROM Cart WHERE cartid = ? AND userid = ?"
-    result = execute_query(sql, (cartid, userid), True)
+    # Fetch the order snapshot, which only exists once completed
+    order, cart_items = orders.get_order(userid, cartid)
 
-    if not result or result[0] != 'completed':
-        # If cart isn't found or not completed, show error page
+    if not order:
+        # If the order isn't found or isn't the user's, show error page
         return render_template('404.html'), 404
 
-    # Fetch items from the completed cart
-    sql = """
-        SELECT Soap.soapid, Soap.name, Soap.price, CartItem.quantity
-        FROM CartItem
-        JOIN Soap ON Soap.soapid = CartItem.soapid
-        WHERE CartItem.cartid = ?
-        """
-    cart_items = execute_query(sql, (cartid,), fetchall=True)
-
-    # Calculate the total price
-    total_price = "{:.2f}".format(sum(item[2] * item[3]
-                                      for item in cart_items))
+    # The total was worked out when the order was completed
+    total_price = "{:.2f}".format(order[3])
 
     # Format items for display
     formatted_cart_items = [
@@ -409,10 +429,15 @@ def view_previous_order(cartid):
         for item in cart_items
     ]
 
+    # Quantities of these soaps in the current cart, for the buttons
+    cart_quantities = cart.quantities(userid,
+                                      [item[0] for item in cart_items])
+
     # Return the previous order details
     return render_template("view_previous_order.html",
                            cart_items=formatted_cart_items,
                            total_price=total_price,
+                           cart_quantities=cart_quantities,
                            cartid=cartid)
 
 
@@ -425,54 +450,60 @@ def previous_carts():
         flash("Please log in to view your previous carts", 'message')
         return redirect(url_for("login"))
 
-    # Fetch all completed carts for the user
-    sql = "SELECT * FROM Cart WHERE userid = ? AND status = 'completed'"
-    completed_carts = execute_query(sql, (userid,), fetchall=True)
+    # Fetch one page of the user's orders, newest first
+    before = request.args.get("before", type=int)
+    completed_carts, next_before = orders.history(
+        userid, before, app.config["ORDER_PAGE_SIZE"])
 
     return render_template("previous_carts.html",
-                           completed_carts=completed_carts)
+                           completed_carts=completed_carts,
+                           next_before=next_before)
 
 
 # Search route
 @app.route("/search")
+@pagecache.cached_page(uses_catalog=True)
 def search():
     search_term = request.args.get("search_term", "").strip()
     sort_option = request.args.get("sort", "").strip()
 
-    sql = "SELECT * FROM Soap WHERE name LIKE ? OR description LIKE ?"
-    # Stores the search parameters if sort is chosen
-    params = [f"%{search_term}%", f"%{search_term}%"]
+    after = fulltext.decode_cursor(request.args.get("after"))
+    before = fulltext.decode_cursor(request.args.get("before"))
 
-    if sort_option:
-        if sort_option == "ascending":
-            sql += " ORDER BY price ASC"
-        elif sort_option == "descending":
-            sql += " ORDER BY price DESC"
-        elif sort_option == "alpha":
-            sql += " ORDER BY name ASC"
-    else:
-        sql += " ORDER BY soapid ASC"
-
-    results = execute_query(sql, params, fetchall=True)
+    # Matching soaps come from the full-text index, one page at a time,
+    # and their details from the cached catalog
+    page = fulltext.search_soaps(search_term, sort_option, after, before,
+                                 app.config["SEARCH_PAGE_SIZE"])
+    soaps = catalog.get_catalog().by_id
+    results = [soaps[soapid] for soapid in page.soapids if soapid in soaps]
 
+    # Quantities for the add/remove buttons, for this page's soaps only
     cart_quantities = {}
     userid = session.get('userid')
     if userid:
-        # SQL for gathering the quantity of soaps for button display
-        sql = """SELECT soapid, quantity
-                 FROM CartItem
-                 WHERE cartid IN (
-                     SELECT cartid
-                     FROM Cart
-                     WHERE userid = ? AND status = 'open'
-                 )"""
-        items = execute_query(sql, (userid,), fetchall=True)
-        # Stores quantities in a dictionary for template
-        cart_quantities = {item[0]: item[1] for item in items}
-
-    return render_template("search.html", results=results,
+        cart_quantities = cart.quantities(userid, page.soapids)
+
+    # Flashed messages are taken out of the session now, because the
+    # session cookie is sent before the streamed body is rendered
+    get_flashed_messages()
+    return stream_template("search.html", results=results,
                            search_term=search_term, sort_option=sort_option,
-                           cart_quantities=cart_quantities)
+                           cart_quantities=cart_quantities,
+                           previous_cursor=page.previous_cursor,
+                           next_cursor=page.next_cursor)
+
+
+# Typeahead suggestions for the search box, from the in-memory index
+@app.route("/search/suggest")
+def search_suggest():
+    query = request.args.get("q", "")
+    soaps = suggest.get_index().suggest(query, app.config["SUGGEST_LIMIT"])
+    response = app.json.response({
+        "query": query,
+        "suggestions": [[soap.soapid, soap.name] for soap in soaps]})
+    # Browsers may reuse suggestions briefly while the user keeps typing
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
 
 
 # Decreasing quantity route
@@ -484,36 +515,13 @@ def decrease_quantity(soapid):
         flash("Please log in to update your cart", 'message')
         return redirect(url_for("login"))
 
-    # Selects the user's open cart
-    sql = "SELECT cartid FROM Cart WHERE userid = ? AND status = 'open'"
-    cart = execute_query(sql, (userid,), fetchone=True)
-
-    if not cart:
-        sql = """INSERT INTO Cart (userid, order_date, status)
-                VALUES (?, datetime('now'), 'open')"""
-        execute_query(sql, (userid,), commit=True)
-        # Fetches the id of the cart just created
-        cart = execute_query(sql, (userid,), fetchone=True)
-
-    cartid = cart[0]
-    sql = "SELECT quantity FROM CartItem WHERE cartid = ? AND soapid = ?"
-    cart_item = execute_query(sql, (cartid, soapid), fetchone=True)
+    # Takes one off the item's quantity, removing it at zero
+    quantity = cart.remove_item(userid, soapid)
 
-    if not cart_item:
+    if quantity is None:
         flash("Item not found", 'error')
         return redirect(url_for("view_current_cart"))
 
-    new_quantity = cart_item[0] - 1
-
-    # Updates quantity if it's not 0, otherwise deletes item
-    if new_quantity > 0:
-        sql = """UPDATE CartItem SET quantity = ? \
-            WHERE cartid = ? AND soapid = ?"""
-        execute_query(sql, (new_quantity, cartid, soapid), commit=True)
-    else:
-        sql = "DELETE FROM CartItem WHERE cartid = ? AND soapid = ?"
-        execute_query(sql, (cartid, soapid), commit=True)
-
     flash("Cart updated", 'success')
     return redirect(request.form.get("redirect_url"))
 
@@ -563,8 +571,9 @@ def update_info(field):
             sql = """UPDATE User SET housenum = ?, street = ?, \
                 suburb = ?, town = ?, region = ?, country = ?, \
                     postcode = ? WHERE userid = ?"""
-            execute_query(sql, (housenum, street, suburb, town, region,
-                                country, postcode, userid), False, False, True)
+            execute_write(sql, (housenum, street, suburb, town, region,
+                                country, postcode, userid))
+            users.forget_user()
 
             flash("Address updated successfully.", "success")
             return redirect(url_for('userinfo', userid=userid))
@@ -588,7 +597,7 @@ def update_info(field):
                                            userid=userid,
                                            valid_fields=valid_fields)
                 # Hashing new password
-                new_value = generate_password_hash(new_value)
+                new_value = passwords.hash_password(new_value)
 
             elif field == 'email':
                 sql = "SELECT * FROM User WHERE email = ?"
@@ -618,7 +627,8 @@ def update_info(field):
 
             # Versatile query for updating different fields
             sql = f"UPDATE User SET {field} = ? WHERE userid = ?"
-            execute_query(sql, (new_value, userid), commit=True)
+            execute_write(sql, (new_value, userid))
+            users.forget_user()
             flash(f"{valid_fields[field]} updated successfully.", "success")
             return redirect(url_for('userinfo', userid=userid))
 
@@ -637,9 +647,11 @@ def delete_account():
         return redirect(url_for('login'))
 
     if request.method == 'POST':
-        sql = "DELETE FROM User WHERE userid = ?"
-        execute_query(sql, (userid,), commit=True)
+        # The account goes straight away; its carts are purged later
+        # in the background, a chunk at a time
+        accounts.delete_account(userid)
         # Clears user session once account is deleted
+        users.forget_user()
         session.clear()
         flash("Your account has been successfully deleted.", "success")
         return redirect(url_for('home'))
@@ -649,21 +661,70 @@ def delete_account():
 
 # About page
 @app.route("/about")
+@pagecache.cached_page()
 def about():
     return render_template("about.html")
 
 
 # FAQs page
 @app.route("/faqs")
+@pagecache.cached_page()
 def faqs():
     return render_template("faqs.html")
 
 
 # Image credits page
 @app.route("/credits")
+@pagecache.cached_page()
 def credit():
     return render_template("credit.html")
 
 
+def sales_report():
+    # Both report views read only the rollups, never the order tables
+    days = request.args.get("days", app.config["SALES_REPORT_DAYS"],
+                            type=int)
+    days = min(max(days, 1), 366)
+    soaps = catalog.get_catalog().by_id
+    top = [{"soapid": soapid,
+            "name": soaps[soapid].name if soapid in soaps else None,
+            "quantity": quantity, "revenue": revenue}
+           for soapid, quantity, revenue in sales.top_sellers(
+               days, app.config["SALES_TOP_SELLERS"])]
+    daily = [{"day": day, "quantity": quantity, "revenue": revenue}
+             for day, quantity, revenue in sales.daily_revenue(days)]
+    return {"days": days, "top_sellers": top, "daily": daily}
+
+
+# Sales report for admins
+@app.route("/admin/sales")
+def admin_sales():
+    if not users.is_admin():
+        return render_template('404.html'), 404
+    return render_template("admin_sales.html", report=sales_report())
+
+
+# The same report as JSON
+@app.route("/admin/sales.json")
+def admin_sales_json():
+    if not users.is_admin():
+        return {"error": "not found"}, 404
+    return sales_report()
+
+
+# Health check for load balancers and the serve.py process manager
+@app.route("/health")
+def health():
+    try:
+        db.reader().execute("SELECT 1").fetchone()
+    except sqlite3.Error as e:
+        return {"status": "error", "error": str(e)}, 503
+    return {"status": "ok", "pid": os.getpid(),
+            "catalog_version": catalog.current_version(),
+            "admission": app.extensions["soap_admission"].stats()}
+
+
+# Development server only; run serve.py in production
 if __name__ == "__main__":
+    migrations.upgrade(app)
     app.run(debug=True)
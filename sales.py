@@ -0,0 +1,145 @@
+# Sales rollups: completing an order adds its lines to per-day, per-soap
+# totals in the same transaction, and reports read only those totals, so
+# they cost the same however long the order history grows
+import time
+
+import click
+
+import db
+
+# Default reporting window and number of top sellers shown
+DEFAULT_REPORT_DAYS = 7
+DEFAULT_TOP_SELLERS = 10
+
+# Sums a range of orders into the staging table during a rebuild
+STAGE_SQL = """INSERT INTO SalesDailyRebuild (day, soapid, quantity, revenue)
+    SELECT date(OrderHeader.completed_at), OrderLine.soapid,
+           SUM(OrderLine.quantity),
+           ROUND(SUM(OrderLine.quantity * OrderLine.unit_price), 2)
+    FROM OrderHeader
+    JOIN OrderLine ON OrderLine.orderid = OrderHeader.orderid
+    WHERE OrderHeader.orderid > ? AND OrderHeader.orderid <= ?
+    AND OrderHeader.completed_at < ?
+    GROUP BY 1, 2
+    ON CONFLICT (day, soapid) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = ROUND(revenue + excluded.revenue, 2)"""
+
+# Sums the orders completed since a rebuild started into the staging table
+STAGE_LATE_SQL = """INSERT INTO SalesDailyRebuild
+    (day, soapid, quantity, revenue)
+    SELECT date(OrderHeader.completed_at), OrderLine.soapid,
+           SUM(OrderLine.quantity),
+           ROUND(SUM(OrderLine.quantity * OrderLine.unit_price), 2)
+    FROM OrderHeader
+    JOIN OrderLine ON OrderLine.orderid = OrderHeader.orderid
+    WHERE OrderHeader.completed_at >= ?
+    GROUP BY 1, 2
+    ON CONFLICT (day, soapid) DO UPDATE SET
+        quantity = quantity + excluded.quantity,
+        revenue = ROUND(revenue + excluded.revenue, 2)"""
+
+
+def record_order(connection, orderid):
+    """
+    Adds one order's lines to today's totals. Runs inside the caller's
+    transaction, so the rollup and the order commit together.
+    """
+    sql = """INSERT INTO SalesDaily (day, soapid, quantity, revenue)
+             SELECT date(OrderHeader.completed_at), OrderLine.soapid,
+                    OrderLine.quantity,
+                    ROUND(OrderLine.quantity * OrderLine.unit_price, 2)
+             FROM OrderHeader
+             JOIN OrderLine ON OrderLine.orderid = OrderHeader.orderid
+             WHERE OrderHeader.orderid = ?
+             ON CONFLICT (day, soapid) DO UPDATE SET
+                 quantity = quantity + excluded.quantity,
+                 revenue = ROUND(revenue + excluded.revenue, 2)"""
+    connection.execute(sql, (orderid,))
+
+
+def daily_revenue(days=DEFAULT_REPORT_DAYS):
+    """
+    Returns (day, items sold, revenue) for each of the last `days` days
+    that had sales, newest first.
+    """
+    sql = """SELECT day, SUM(quantity), ROUND(SUM(revenue), 2)
+             FROM SalesDaily
+             WHERE day > date('now', ?)
+             GROUP BY day ORDER BY day DESC"""
+    return db.reader().execute(sql, (f"-{int(days)} days",)).fetchall()
+
+
+def top_sellers(days=DEFAULT_REPORT_DAYS, limit=DEFAULT_TOP_SELLERS):
+    """
+    Returns (soapid, quantity, revenue) for the best-selling soaps over
+    the last `days` days.
+    """
+    sql = """SELECT soapid, SUM(quantity) AS sold, ROUND(SUM(revenue), 2)
+             FROM SalesDaily
+             WHERE day > date('now', ?)
+             GROUP BY soapid ORDER BY sold DESC, soapid LIMIT ?"""
+    return db.reader().execute(
+        sql, (f"-{int(days)} days", limit)).fetchall()
+
+
+def rebuild(chunk_size, pause=0.0):
+    """
+    Recomputes the rollups from the order history. Yields
+    (orderid reached, last orderid) after each chunk.
+
+    Simplified explanation:
+    - Orders are summed into a staging table in orderid ranges, one
+      short transaction per range.
+    - Only orders completed before the rebuild started are staged.
+      Those completed while it runs are added in the final transaction,
+      which then swaps the staged totals in, so none are lost or
+      counted twice.
+    """
+    connection = db.reader()
+    started = connection.execute("SELECT datetime('now')").fetchone()[0]
+    last = connection.execute(
+        "SELECT COALESCE(MAX(orderid), 0) FROM OrderHeader").fetchone()[0]
+
+    with db.write_transaction() as connection:
+        connection.execute("DELETE FROM SalesDailyRebuild")
+
+    for start in range(0, last, chunk_size):
+        with db.write_transaction() as connection:
+            connection.execute(STAGE_SQL, (start, start + chunk_size, started))
+        yield min(start + chunk_size, last), last
+        if pause:
+            time.sleep(pause)
+
+    with db.write_transaction() as connection:
+        connection.execute(STAGE_LATE_SQL, (started,))
+        connection.execute("DELETE FROM SalesDaily")
+        connection.execute("""INSERT INTO SalesDaily
+                              SELECT * FROM SalesDailyRebuild""")
+        connection.execute("DELETE FROM SalesDailyRebuild")
+
+
+@click.group("sales")
+def sales_cli():
+    """Sales rollup commands."""
+
+
+@sales_cli.command("rebuild")
+@click.option("--chunk-size", default=5000, show_default=True,
+              help="Orders per transaction.")
+@click.option("--pause", default=0.0, show_default=True,
+              help="Seconds to wait between chunks.")
+def rebuild_command(chunk_size, pause):
+    """Recompute the daily sales rollups from order history."""
+    for reached, last in rebuild(chunk_size, pause):
+        click.echo(f"Summed orders up to {reached} of {last}", err=True)
+    click.echo("Sales rollups rebuilt")
+
+
+def init_app(app):
+    """
+    Registers the report defaults and the `flask sales` commands.
+    """
+    app.config.setdefault("SALES_REPORT_DAYS", DEFAULT_REPORT_DAYS)
+    app.config.setdefault("SALES_TOP_SELLERS", DEFAULT_TOP_SELLERS)
+    app.cli.add_command(sales_cli)
@@ -0,0 +1,228 @@
+# Production entry point: loads and warms the app once, then forks worker
+# processes that share one listening socket
+#
+#   SOAP_SECRET_KEY=... SOAP_DATABASE=/srv/soap/Soap.db \
+#       python serve.py --bind 0.0.0.0:8000 --workers 4
+#
+# Signals to the master process:
+#   TERM/INT  stop accepting, let in-flight requests finish, then exit
+#   HUP       graceful reload: re-exec with fresh code on the same socket
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+logger = logging.getLogger("soap.serve")
+
+# Seconds workers get to finish in-flight requests before being killed
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+# Set across a reload so the new master reuses the listening socket
+LISTEN_FD_VARIABLE = "SOAP_LISTEN_FD"
+
+# Pages requested once before forking, to fill the caches workers inherit
+WARM_PAGES = ["/", "/search", "/about", "/faqs", "/credits"]
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host.strip("[]") or "127.0.0.1", int(port)
+
+
+def listening_socket(host, port):
+    # Reuses the socket handed over by a reload, if there is one
+    fd = os.environ.pop(LISTEN_FD_VARIABLE, None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+    return socket.create_server((host, port), backlog=2048,
+                                family=socket.AF_INET6 if ":" in host
+                                else socket.AF_INET)
+
+
+def warm(app):
+    """
+    Does the per-process setup once in the master, so every worker
+    starts with it: compiled templates, the catalog snapshot, the
+    suggestion index and the page and fragment caches. Database
+    connections are closed after, since they can't be shared across
+    the fork.
+    """
+    import catalog
+    import db
+    import suggest
+
+    start = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        catalog.get_catalog()
+        suggest.get_index()
+    client = app.test_client()
+    for path in WARM_PAGES:
+        client.get(path).get_data()
+    db.close_connections(app)
+    logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Idle keep-alive connections are dropped after this many seconds,
+    # so they can't hold up a worker that is shutting down
+    timeout = 10
+
+
+def run_worker(app, listener, host, port):
+    """
+    Serves requests on the shared socket until told to stop.
+    """
+    server = make_server(host, port, app, threaded=True,
+                         request_handler=RequestHandler,
+                         fd=listener.fileno())
+    # Non-daemon request threads are joined on close, so a stopping
+    # worker finishes the requests it has already accepted
+    server.daemon_threads = False
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it can't run right here
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.serve_forever()
+    server.server_close()
+
+
+class Master:
+    """
+    Keeps `workers` worker processes running.
+
+    Simplified explanation:
+    - Workers are forked from this process after warm(), so they share
+      its loaded code and caches instead of each building their own.
+    - A worker that dies is replaced.
+    - Signal handlers only set flags; the main loop acts on them.
+    """
+
+    def __init__(self, app, listener, host, port, workers, timeout):
+        self.app = app
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.size = workers
+        self.timeout = timeout
+        self.workers = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        # In the worker: exit normally so atexit handlers (such as the
+        # batch writer's final flush) still run
+        run_worker(self.app, self.listener, self.host, self.port)
+        sys.exit(0)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping:
+                    logger.warning(f"Worker {pid} exited with status "
+                                   f"{os.waitstatus_to_exitcode(status)}")
+
+    def signal_workers(self, signum):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        logger.info(f"Listening on {self.host}:{self.port} with "
+                    f"{self.size} workers")
+
+        while not self.stopping and not self.reloading:
+            self.reap()
+            while len(self.workers) < self.size:
+                self.spawn()
+            time.sleep(0.5)
+
+        # Old workers drain their requests while the new master loads
+        self.signal_workers(signal.SIGTERM)
+        if self.reloading:
+            self.reload()
+        self.drain()
+
+    def drain(self):
+        deadline = time.monotonic() + self.timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(signal.SIGKILL)
+        logger.info("Stopped")
+
+    def reload(self):
+        # The listening socket stays open across exec, so connections
+        # queue in its backlog instead of being refused meanwhile. The
+        # old workers are still our children and are reaped after exec
+        logger.info("Reloading")
+        os.set_inheritable(self.listener.fileno(), True)
+        os.environ[LISTEN_FD_VARIABLE] = str(self.listener.fileno())
+        os.execv(sys.executable, sys.orig_argv)
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_reload(self, signum, frame):
+        self.reloading = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the shop in production")
+    parser.add_argument("--bind", help="host:port (default 127.0.0.1:8000, "
+                                       "or SOAP_BIND)")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per CPU core, "
+                             "or SOAP_WORKERS)")
+    parser.add_argument("--graceful-timeout", type=int,
+                        default=DEFAULT_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s [%(process)d] %(message)s")
+
+    # Every worker, and every restart, must sign sessions with one key
+    if not os.environ.get("SOAP_SECRET_KEY"):
+        sys.exit("SOAP_SECRET_KEY must be set to serve in production")
+
+    import migrations
+    from routes import app
+
+    host, port = parse_bind(args.bind or app.config.get("BIND",
+                                                        "127.0.0.1:8000"))
+    workers = args.workers or app.config.get("WORKERS") or os.cpu_count()
+    listener = listening_socket(host, port)
+    # Once, in the master, before any worker can serve the old schema
+    migrations.upgrade(app)
+    warm(app)
+    Master(app, listener, host, port, workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
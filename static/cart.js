@@ -0,0 +1,77 @@
+// Updates cart controls in place through the JSON API instead of posting
+// the form and reloading the page. Forms marked with data-cart-change
+// still work as plain forms if this script fails or the request does.
+(function () {
+    "use strict";
+
+    var API = "/api/v1/cart";
+
+    function setHidden(selector, hidden) {
+        document.querySelectorAll(selector).forEach(function (element) {
+            element.hidden = hidden;
+        });
+    }
+
+    function setText(selector, text) {
+        document.querySelectorAll(selector).forEach(function (element) {
+            element.textContent = text;
+        });
+    }
+
+    // Shows each soap on the page with its quantity from the cart
+    function render(cart) {
+        var quantities = {};
+        cart.items.forEach(function (item) {
+            quantities[item[0]] = item;
+        });
+
+        document.querySelectorAll("[data-cart-line]").forEach(function (line) {
+            var soapid = line.dataset.cartLine;
+            var item = quantities[soapid];
+            var quantity = item ? item[1] : 0;
+
+            setText('[data-cart-quantity="' + soapid + '"]', quantity);
+            if (item) {
+                setText('[data-cart-line-total="' + soapid + '"]',
+                        (item[1] * item[2]).toFixed(2));
+            }
+            // Lines of the cart page go away at zero; elsewhere the
+            // quantity buttons turn back into "Add to Cart"
+            if (line.hasAttribute("data-cart-removable") && !quantity) {
+                line.remove();
+            }
+            setHidden('[data-cart-controls="' + soapid + '"]', !quantity);
+            setHidden('[data-cart-add="' + soapid + '"]', !!quantity);
+        });
+        setText("[data-cart-total]", cart.total.toFixed(2));
+
+        if (document.querySelector("[data-cart-page]") && !cart.items.length) {
+            window.location.reload();
+        }
+    }
+
+    document.addEventListener("submit", function (event) {
+        var form = event.target;
+        if (!form.dataset.cartChange || !window.fetch) {
+            return;
+        }
+        event.preventDefault();
+
+        var change = {};
+        change[form.dataset.soapid] = Number(form.dataset.cartChange);
+        fetch(API, {
+            method: "PATCH",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify({add: change}),
+            credentials: "same-origin"
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        }).then(render).catch(function () {
+            // Let the server handle it the old way, with its messages
+            form.submit();
+        });
+    });
+}());
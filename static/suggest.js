@@ -0,0 +1,43 @@
+// Fills the search boxes' suggestion list from /search/suggest as the
+// user types. Requests wait for a short pause in typing, and answers to
+// older queries are ignored.
+(function () {
+    "use strict";
+
+    var DELAY_MS = 120;
+    var timer = null;
+    var latest = "";
+
+    function show(list, suggestions) {
+        list.replaceChildren.apply(list, suggestions.map(function (soap) {
+            var option = document.createElement("option");
+            option.value = soap[1];
+            return option;
+        }));
+    }
+
+    document.addEventListener("input", function (event) {
+        var input = event.target;
+        var list = input.list;
+        if (input.name !== "search_term" || !list || !window.fetch) {
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = input.value.trim();
+            latest = query;
+            if (!query) {
+                show(list, []);
+                return;
+            }
+            fetch("/search/suggest?q=" + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (data.query === latest) {
+                        show(list, data.suggestions);
+                    }
+                })
+                .catch(function () {});
+        }, DELAY_MS);
+    });
+}());
@@ -0,0 +1,354 @@
+# Typeahead suggestions for the search box, answered from an in-memory
+# prefix index over soap names and description keywords instead of the
+# database. The index follows the catalog version, updating only the
+# soaps that changed
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+import click
+from flask import current_app
+
+import catalog
+
+# Default number of suggestions returned
+DEFAULT_SUGGEST_LIMIT = 8
+
+# Longest query looked at, matching the search box's maxlength
+MAX_QUERY_LENGTH = 50
+
+# A catalog change touching more than this share of the soaps rebuilds
+# the index from scratch rather than patching it
+REBUILD_FRACTION = 0.25
+
+# Description words too common to be worth suggesting on
+STOP_WORDS = frozenset("""a an and are as at be by for from has have in
+    into is it its of on or our soap soaps that the this to with your
+    you""".split())
+
+# Most entries a tier skips because they lack one of the query's earlier
+# words, before giving up on that tier
+SCAN_LIMIT = 500
+
+
+def words(text):
+    """
+    Splits text into lowercase words.
+    """
+    return re.findall(r"\w+", text.casefold())
+
+
+class PrefixIndex:
+    """
+    Sorted keys with the soapid each one points to, in two parallel
+    arrays, so a prefix is found with a binary search.
+
+    Simplified explanation:
+    - Entries are ordered by (key, soapid). Every key starting with a
+      prefix sits in one run, found with bisect in O(log n).
+    - patched() applies a small catalog change by copying the runs of
+      entries between the changes into a new index, so readers of this
+      one are never held up.
+    """
+
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self.keys = [key for key, _ in entries]
+        self.soapids = array("l", (soapid for _, soapid in entries))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _run(self, key):
+        # Start and end of the entries with exactly this key
+        start = bisect_left(self.keys, key)
+        return start, bisect_right(self.keys, key, start)
+
+    def soapids_of(self, key):
+        # The soapids with exactly this key, in order
+        start, end = self._run(key)
+        return self.soapids[start:end]
+
+    def _position(self, key, soapid):
+        # Equal keys are ordered by soapid, so look inside their run
+        start, end = self._run(key)
+        return bisect_left(self.soapids, soapid, start, end)
+
+    def contains(self, key, soapid):
+        position = self._position(key, soapid)
+        return position < len(self.keys) and self.keys[position] == key \
+            and self.soapids[position] == soapid
+
+    def patched(self, removed, added):
+        """
+        Returns a new index with the `removed` (key, soapid) entries
+        taken out and the `added` ones put in.
+        """
+        # Where each change falls in this index; an insert goes before
+        # a removal at the same position
+        changes = sorted(
+            [(self._position(key, soapid), False, key, soapid)
+             for key, soapid in added] +
+            [(self._position(key, soapid), True, key, soapid)
+             for key, soapid in removed if self.contains(key, soapid)])
+        index = PrefixIndex()
+        start = 0
+        for position, remove, key, soapid in changes:
+            # The unchanged entries in between are copied as slices
+            index.keys += self.keys[start:position]
+            index.soapids += self.soapids[start:position]
+            start = position
+            if remove:
+                start += 1
+            else:
+                index.keys.append(key)
+                index.soapids.append(soapid)
+        index.keys += self.keys[start:]
+        index.soapids += self.soapids[start:]
+        return index
+
+    def scan(self, prefix):
+        """
+        Yields the soapids of keys starting with `prefix`, in key order.
+        """
+        keys = self.keys
+        position = bisect_left(keys, prefix)
+        while position < len(keys) and keys[position].startswith(prefix):
+            yield self.soapids[position]
+            position += 1
+
+    def memory_bytes(self, seen):
+        # Strings shared with other indexes are only counted once
+        size = sys.getsizeof(self.keys) + sys.getsizeof(self.soapids)
+        for key in self.keys:
+            if id(key) not in seen:
+                seen.add(id(key))
+                size += sys.getsizeof(key)
+        return size
+
+
+def contains(soapids, soapid):
+    # Membership test on a sorted array of soapids
+    position = bisect_left(soapids, soapid)
+    return position < len(soapids) and soapids[position] == soapid
+
+
+def collect(found, soapids, limit):
+    # Adds soapids not already found, stopping once there are `limit`
+    for soapid in soapids:
+        if len(found) >= limit:
+            break
+        if soapid not in found:
+            found.append(soapid)
+    return found
+
+
+def soap_keys(soap):
+    """
+    Returns the keys a soap is found by: its whole name, each word of
+    its name, and the other notable words of its description.
+    """
+    name_words = words(soap.name)
+    keywords = {word for word in words(soap.description or "")
+                if len(word) > 2 and word not in STOP_WORDS}
+    return (sys.intern(" ".join(name_words)),
+            {sys.intern(word) for word in name_words},
+            {sys.intern(word) for word in keywords - set(name_words)})
+
+
+class SuggestIndex:
+    """
+    Prefix index over the catalog, in three tiers searched in order:
+    names starting with the query, then names with a word starting with
+    its last word, then descriptions with such a word.
+
+    Simplified explanation:
+    - Each tier stops as soon as it has enough suggestions, so a lookup
+      costs a few binary searches however big the catalog is.
+    - Earlier words of the query must all appear in a soap's name or
+      keywords for it to be suggested on the later tiers. That is a
+      bisect in each word's run of entries, which are sorted by soapid,
+      so no per-soap word sets are kept.
+    - update() applies a new catalog version by removing and re-adding
+      only the soaps that changed, on copies of the tiers that are
+      swapped in under the lock.
+    """
+
+    def __init__(self, soaps=(), version=None):
+        self._lock = threading.Lock()
+        self.version = None
+        self.rebuild(soaps, version)
+
+    def rebuild(self, soaps, version):
+        start = time.perf_counter()
+        names, name_words, keywords = [], [], []
+        by_id = {}
+        for soap in soaps:
+            name, words_in_name, other_words = soap_keys(soap)
+            by_id[soap.soapid] = soap
+            names.append((name, soap.soapid))
+            name_words.extend((word, soap.soapid) for word in words_in_name)
+            keywords.extend((word, soap.soapid) for word in other_words)
+        tiers = [PrefixIndex(names), PrefixIndex(name_words),
+                 PrefixIndex(keywords)]
+        with self._lock:
+            self.tiers = tiers
+            self.soaps = by_id
+            self.version = version
+        self.build_seconds = time.perf_counter() - start
+
+    @staticmethod
+    def _entries(soaps):
+        # The (key, soapid) entries of each tier for these soaps
+        entries = ([], [], [])
+        for soap in soaps:
+            name, words_in_name, other_words = soap_keys(soap)
+            for tier, keys in zip(entries,
+                                  ([name], words_in_name, other_words)):
+                tier.extend((key, soap.soapid) for key in keys)
+        return entries
+
+    def update(self, soaps, version):
+        """
+        Brings the index up to a new catalog version. Returns the number
+        of soaps that changed.
+        """
+        current = {soap.soapid: soap for soap in soaps}
+        removed = [soap for soapid, soap in self.soaps.items()
+                   if current.get(soapid) != soap]
+        added = [soap for soapid, soap in current.items()
+                 if self.soaps.get(soapid) != soap]
+        changed = len(removed) + len(added)
+
+        if changed > REBUILD_FRACTION * max(len(current), 1):
+            self.rebuild(current.values(), version)
+            return changed
+        # Patch copies and swap them in, as rebuild() does, so lookups
+        # only wait for the swap
+        tiers = [tier.patched(old, new) for tier, old, new in
+                 zip(self.tiers, self._entries(removed),
+                     self._entries(added))]
+        by_id = {soapid: soap for soapid, soap in self.soaps.items()
+                 if current.get(soapid) == soap}
+        by_id.update((soap.soapid, soap) for soap in added)
+        with self._lock:
+            self.tiers = tiers
+            self.soaps = by_id
+            self.version = version
+        return changed
+
+    def suggest(self, query, limit=DEFAULT_SUGGEST_LIMIT):
+        """
+        Returns up to `limit` soaps matching the text typed so far.
+        """
+        query_words = words(query[:MAX_QUERY_LENGTH])
+        if not query_words or limit <= 0:
+            return []
+        earlier, last = set(query_words[:-1]), query_words[-1]
+
+        with self._lock:
+            names, *word_tiers = self.tiers
+            found = collect([], names.scan(" ".join(query_words)), limit)
+            if earlier:
+                matches = self._with_earlier_words(earlier, last, word_tiers)
+            else:
+                matches = chain.from_iterable(
+                    tier.scan(last) for tier in word_tiers)
+            found = collect(found, matches, limit)
+            return [self.soaps[soapid] for soapid in found]
+
+    def _with_earlier_words(self, earlier, last, word_tiers):
+        """
+        Yields soaps that have every earlier word of the query and a
+        word starting with the last one, name words before keywords.
+
+        Simplified explanation:
+        - Each earlier word's entries are a run sorted by soapid, so
+          checking a soap for it is a bisect.
+        - If the rarest earlier word has few soaps, those are checked
+          directly. Otherwise the last word's matches are walked,
+          skipping at most SCAN_LIMIT per tier.
+        """
+        word_runs = [[tier.soapids_of(word) for tier in word_tiers]
+                     for word in earlier]
+
+        def has_earlier_words(soapid):
+            return all(any(contains(soapids, soapid) for soapids in runs)
+                       for runs in word_runs)
+
+        rarest = min(word_runs, key=lambda runs: sum(map(len, runs)))
+        if sum(map(len, rarest)) <= SCAN_LIMIT:
+            candidates = sorted(set().union(*rarest))
+            # soap_keys gives name words at 1 and keywords at 2
+            for position in (1, 2):
+                for soapid in candidates:
+                    keys = soap_keys(self.soaps[soapid])[position]
+                    if any(word.startswith(last) for word in keys) \
+                            and has_earlier_words(soapid):
+                        yield soapid
+            return
+
+        for tier in word_tiers:
+            skipped = 0
+            for soapid in tier.scan(last):
+                if has_earlier_words(soapid):
+                    yield soapid
+                else:
+                    skipped += 1
+                    if skipped >= SCAN_LIMIT:
+                        break
+
+    def stats(self):
+        seen = set()
+        with self._lock:
+            size = sum(tier.memory_bytes(seen) for tier in self.tiers)
+            size += sys.getsizeof(self.soaps)
+            return {"soaps": len(self.soaps),
+                    "entries": sum(len(tier) for tier in self.tiers),
+                    "memory_bytes": size,
+                    "version": self.version,
+                    "build_ms": round(self.build_seconds * 1000, 3)}
+
+
+def get_index():
+    """
+    Returns the app's suggestion index, first bringing it up to date
+    with the catalog if the catalog version has moved on.
+    """
+    index = current_app.extensions["soap_suggest_index"]
+    if index.version != catalog.current_version():
+        with current_app.extensions["soap_suggest_lock"]:
+            snapshot = catalog.get_catalog()
+            if index.version != snapshot.version:
+                changed = index.update(snapshot.gallery, snapshot.version)
+                current_app.logger.info(
+                    f"Suggestion index updated to catalog version "
+                    f"{snapshot.version} ({changed} soaps changed)")
+    return index
+
+
+@click.group("suggest")
+def suggest_cli():
+    """Search suggestion commands."""
+
+
+@suggest_cli.command("stats")
+def stats_command():
+    """Build the suggestion index and report its size."""
+    for name, value in get_index().stats().items():
+        click.echo(f"{name}: {value}")
+
+
+def init_app(app):
+    """
+    Registers the suggestion limit, the `flask suggest` commands and an
+    empty index, which is filled on first use.
+    """
+    app.config.setdefault("SUGGEST_LIMIT", DEFAULT_SUGGEST_LIMIT)
+    app.extensions["soap_suggest_index"] = SuggestIndex()
+    app.extensions["soap_suggest_lock"] = threading.Lock()
+    app.cli.add_command(suggest_cli)
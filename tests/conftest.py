@@ -0,0 +1,43 @@
+# Shared fixtures: every test runs against its own migrated copy of
+# Soap.db, through a minimal app with only the database set up
+import os
+import shutil
+import sys
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+def create_app(database):
+    app = Flask(__name__)
+    app.config["DATABASE"] = database
+    db.init_app(app)
+    return app
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    Path to a fresh copy of Soap.db with every migration applied.
+    """
+    path = str(tmp_path / "Soap.db")
+    shutil.copyfile(os.path.join(ROOT, "Soap.db"), path)
+    connection = db.connect(path)
+    try:
+        migrations.migrate(connection)
+    finally:
+        connection.close()
+    return path
+
+
+@pytest.fixture
+def app(database):
+    app = create_app(database)
+    yield app
+    db.close_connections(app)
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import cart
+import db
+from conftest import create_app
+
+# Parallel adds of one soap, per test
+ADDS = 40
+
+
+def new_user(app):
+    # A user with no open cart, so the adds also race to create it
+    with app.app_context(), db.write_transaction() as connection:
+        sql = """INSERT INTO User (fname, lname, email, password)
+                 VALUES ('Test', 'User', 'cart-test@example.com', '')
+                 RETURNING userid"""
+        return connection.execute(sql).fetchall()[0][0]
+
+
+def add_in_parallel(apps, userid, soapid):
+    """
+    Runs ADDS calls to cart.add_item at once, spread over the apps,
+    and returns the exceptions any of them raised.
+    """
+    start = threading.Barrier(ADDS)
+    errors = []
+
+    def add(app):
+        with app.app_context():
+            start.wait()
+            try:
+                cart.add_item(userid, soapid)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=add, args=(apps[i % len(apps)],))
+               for i in range(ADDS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+# One app shares a writer connection between threads, like one worker;
+# several apps each have their own, like separate worker processes
+# contending for SQLite's write lock
+@pytest.mark.parametrize("workers", [1, 4])
+def test_parallel_adds_count_every_add(database, workers):
+    apps = [create_app(database) for _ in range(workers)]
+    for app in apps:
+        app.config["DB_WRITE_ATTEMPTS"] = 20
+    try:
+        userid = new_user(apps[0])
+        soapid = 1
+        assert add_in_parallel(apps, userid, soapid) == []
+
+        with apps[0].app_context():
+            _, lines = cart.contents(userid)
+            open_carts = db.reader().execute(
+                "SELECT COUNT(*) FROM Cart WHERE userid = ? "
+                "AND status = 'open'", (userid,)).fetchone()[0]
+        assert [(line[0], line[3]) for line in lines] == [(soapid, ADDS)]
+        assert open_carts == 1
+    finally:
+        for app in apps:
+            db.close_connections(app)
+
+
+def test_remove_item_deletes_line_at_zero(app):
+    userid = new_user(app)
+    with app.app_context():
+        assert cart.add_item(userid, 2) == 1
+        assert cart.add_item(userid, 2) == 2
+        assert cart.remove_item(userid, 2) == 1
+        assert cart.remove_item(userid, 2) == 0
+        assert cart.remove_item(userid, 2) is None
+        assert cart.contents(userid)[1] == []
+
+
+def test_update_items_caps_additions(app):
+    userid = new_user(app)
+    with app.app_context():
+        assert cart.update_items(userid, {3: 98}, maximum=99) == {3: 98}
+        assert cart.update_items(userid, changes={3: 5}, maximum=99) \
+            == {3: 99}
+        assert cart.update_items(userid, changes={3: 5, 4: 120},
+                                 maximum=99) == {3: 99, 4: 99}
+        assert cart.update_items(userid, changes={3: -10}, maximum=99) \
+            == {3: 89}
@@ -0,0 +1,35 @@
+import json
+
+import catalogsync
+from conftest import create_app
+
+ROWS = [
+    {"name": "Good Soap", "price": 4.5},
+    {"name": 123, "price": 1},
+    {"name": "Bad Description", "price": 1, "description": ["a"]},
+    {"name": "Bad Picture", "price": 1, "picture": 7},
+    {"name": "Not A Number", "price": "nan"},
+    {"name": "Infinite", "price": "inf"},
+    {"name": "Huge Id", "price": 1, "soapid": 99999999999999999999},
+    {"name": "Another Good Soap", "price": "2"},
+]
+
+
+def test_import_rejects_bad_rows_and_keeps_going(database, tmp_path):
+    path = tmp_path / "soaps.jsonl"
+    path.write_text("".join(json.dumps(row) + "\n" for row in ROWS))
+    app = create_app(database)
+    catalogsync.init_app(app)
+
+    # The flask command pushes an app context; the test runner doesn't
+    with app.app_context():
+        result = app.test_cli_runner().invoke(
+            args=["catalog", "import", str(path)])
+
+    # Rejected rows make the import exit with 1, not raise
+    assert isinstance(result.exception, SystemExit)
+    assert result.exit_code == 1
+    for lineno in range(2, 8):
+        assert f"line {lineno}:" in result.output
+    assert "Imported 2 rows" in result.output
+    assert "rejected 6" in result.output
@@ -0,0 +1,61 @@
+import os
+from functools import partial
+
+import pytest
+from flask import g
+
+import cart
+import db
+import fulltext
+import migrations
+from conftest import ROOT
+
+
+def scans_in(connection, queries):
+    return [(sql, step) for sql in queries
+            for step in migrations.full_scans(connection, sql)]
+
+
+@pytest.mark.parametrize("module", migrations.CHECKED_MODULES)
+def test_literal_queries_use_indexes(app, module):
+    queries = [sql for _, sql in
+               migrations.find_queries(os.path.join(ROOT, module))]
+    with app.app_context():
+        assert scans_in(db.reader(), queries) == []
+
+
+# Queries built as f-strings, which find_queries can't see, are checked
+# by running them with representative arguments and explaining every
+# statement the request recorded
+def search_calls():
+    for term in ("", "lavender oat"):
+        for sort in fulltext.SORT_KEYS:
+            cursor = [1] * len(key_columns(term, sort))
+            yield partial(fulltext.search_soaps, term, sort, page_size=2)
+            yield partial(fulltext.search_soaps, term, sort, after=cursor)
+            yield partial(fulltext.search_soaps, term, sort, before=cursor)
+
+
+def key_columns(term, sort):
+    # The sort search_soaps actually uses for this term
+    if term and not sort:
+        sort = "relevance"
+    elif not term and sort == "relevance":
+        sort = ""
+    return fulltext.SORT_KEYS[sort][0]
+
+
+def cart_calls():
+    yield partial(cart.quantities, 1, [1, 2, 3])
+    yield partial(cart.update_items, 1, {1: 2}, {2: 1, 3: -1})
+    yield partial(cart.update_items, 1, {1: 0, 2: 0}, {3: -5})
+
+
+@pytest.mark.parametrize("calls", [search_calls, cart_calls])
+def test_built_queries_use_indexes(app, calls):
+    with app.test_request_context():
+        for call in calls():
+            call()
+        queries = {record.sql for record in g.queries}
+        assert queries
+        assert scans_in(db.reader(), queries) == []
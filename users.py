@@ -0,0 +1,65 @@
+# Request-scoped loading of the logged-in user, so each request fetches
+# the User row at most once and most renders don't fetch it at all
+from flask import current_app, g, session
+
+import db
+
+
+def current_user():
+    """
+    Returns the logged-in user's User row, or None if nobody is logged in
+    (or the row is gone). The row is fetched once per request.
+    """
+    userid = session.get("userid")
+    if not userid:
+        return None
+    if "user" not in g:
+        sql = "SELECT * FROM User WHERE userid = ?"
+        g.user = db.reader().execute(sql, (userid,)).fetchone()
+    return g.user
+
+
+def display_name():
+    """
+    Returns the first name shown in the navbar.
+
+    Simplified explanation:
+    - The name is kept in the (signed) session cookie after it is first
+      looked up, so ordinary page views don't query User at all.
+    - forget_user() drops it whenever the row changes.
+    """
+    if not session.get("userid"):
+        return None
+    fname = session.get("user_fname")
+    if fname is None:
+        user = current_user()
+        if user:
+            fname = user[1]
+            session["user_fname"] = fname
+    return fname
+
+
+def is_admin():
+    """
+    Returns True if the logged-in user's email is listed in the
+    ADMIN_EMAILS config (a list, or a comma-separated string).
+    """
+    admins = current_app.config.get("ADMIN_EMAILS") or []
+    if isinstance(admins, str):
+        admins = admins.split(",")
+    user = current_user()
+    return bool(user) and user[10].lower() in {
+        email.strip().lower() for email in admins}
+
+
+def remember_user(user):
+    # Stores the login and display name for a freshly logged-in user
+    session["userid"] = user[0]
+    session["user_fname"] = user[1]
+    g.user = user
+
+
+def forget_user():
+    # Drops the cached copies after the user's row is changed
+    g.pop("user", None)
+    session.pop("user_fname", None)